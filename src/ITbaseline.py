@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+.. _ITbaseline
+
+Baseline estimators and expected-death bands of IT mortality data.
+
+All estimators reduce the year axis of an array of counts (or the year columns
+of a dataframe) in a single vectorized call, so that the baseline of every
+series of a :class:`ITcube.DeathCube` is computed at once.
+
+**Dependencies**
+
+*require*:      :mod:`numpy`, :mod:`pandas`
+
+*optional*:     :mod:`scipy`
+
+**Contents**
+"""
+
+# *since*:        Mon Oct 19 10:03:17 2026
+
+#%% Settings
+
+import warnings
+from statistics import NormalDist
+
+try:
+    import numpy as np
+    import pandas as pd
+except:
+    raise IOError("Impossible to handle dataframe not available: abort...")
+
+from ITlazy import lazy_import, is_available
+from ITcube import YEAR
+
+if is_available('scipy'):
+    sstats = lazy_import('scipy.stats')
+else:
+    warnings.warn("Package scipy not available - Poisson bands use the normal approximation")
+    sstats = None
+
+BASEYEARS = list(range(2015, YEAR))
+
+
+#%% Estimators
+# every estimator takes the reference counts with the years on the last axis
+
+def _mean(ref, yref, year, **kwargs):
+    return np.nanmean(ref, axis=-1)
+
+def _max(ref, yref, year, **kwargs):
+    return np.nanmax(ref, axis=-1)
+
+def _median(ref, yref, year, **kwargs):
+    return np.nanmedian(ref, axis=-1)
+
+def _trimmed(ref, yref, year, trim = 0.2, **kwargs):
+    # symmetric trimmed mean: drop int(trim*n) values at both ends of the
+    # sorted reference years
+    n = ref.shape[-1]
+    k = int(trim * n)
+    if 2*k >= n:
+        raise IOError("Trimming proportion too large for %s reference years" % n)
+    return np.nanmean(np.sort(ref, axis=-1)[..., k:n-k], axis=-1)
+
+def _trend(ref, yref, year, **kwargs):
+    # linear trend fitted by least squares over the reference years and
+    # projected onto `year`; closed form so that all series are fitted at once
+    x = np.asarray(yref, dtype=float)
+    x = x - x.mean()
+    ym = np.nanmean(ref, axis=-1)
+    slope = np.nansum(x * (ref - ym[..., None]), axis=-1) / (x**2).sum()
+    return np.clip(ym + slope * (year - np.mean(yref)), 0, None)
+
+BASELINES = {'mean':     _mean,
+             'max':      _max,
+             'median':   _median,
+             'trimmed':  _trimmed,
+             'trend':    _trend
+             }
+
+
+def reference(values, years = None, ref = None, year = YEAR, axis = -2):
+    """Extract the counts of the reference years, with years moved to the last axis.
+    """
+    if isinstance(values, pd.DataFrame):
+        years = [c for c in values.columns if isinstance(c, (int, np.integer))]
+        values, axis = values[years].values, -1
+    elif years is None:
+        raise IOError("Years of the data need to be passed")
+    years = list(years)
+    if ref is None:
+        ref = [y for y in years if y != year and y in BASEYEARS] \
+            or [y for y in years if y != year]
+    ref = list(ref)
+    try:
+        iref = [years.index(y) for y in ref]
+    except ValueError:
+        raise IOError("Reference years %s not available in the data" % ref)
+    return np.moveaxis(np.take(np.asarray(values, dtype=float), iref, axis=axis), axis, -1), ref
+
+
+def baseline(values, years = None, method = 'mean', ref = None, year = YEAR, axis = -2, **kwargs):
+    """Compute the baseline of every series over the reference years.
+
+    `values` is either an array with the years on `axis` (default: the
+    ``(.., year, day)`` layout of the cube), or a dataframe with one column per
+    year, in which case a series is returned. Available methods are the keys
+    of :data:`BASELINES`; `ref` defaults to 2015-2019.
+    """
+    try:
+        estimator = BASELINES[method]
+    except KeyError:
+        raise IOError("Baseline method '%s' not recognised - must be one of %s"
+                      % (method, list(BASELINES.keys())))
+    refvalues, ref = reference(values, years = years, ref = ref, year = year, axis = axis)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning) # all-nan series
+        base = estimator(refvalues, ref, year, **kwargs)
+    if isinstance(values, pd.DataFrame):
+        return pd.Series(base, index = values.index, name = 'base')
+    return base
+
+
+#%% Expected-death bands
+
+def dispersion(values, years = None, ref = None, year = YEAR, axis = -2, pooled = False):
+    """Quasi-Poisson dispersion of the reference counts (Pearson estimate).
+
+    When `pooled` is set, a single dispersion is estimated for all series
+    along the day axis (i.e. the last axis of the reference counts).
+    """
+    refvalues, ref = reference(values, years = years, ref = ref, year = year, axis = axis)
+    mu = np.nanmean(refvalues, axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2 = np.where(mu > 0, (refvalues - mu)**2 / mu, 0)
+    n = refvalues.shape[-1]
+    if pooled is True:
+        phi = chi2.sum(axis=(-2,-1)) / (chi2.shape[-2] * (n - 1))
+        phi = phi[..., None]
+    else:
+        phi = chi2.sum(axis=-1) / (n - 1)
+    # underdispersion is not corrected
+    return np.maximum(phi, 1.)
+
+
+def expected_band(base, level = 0.95, family = 'poisson', phi = None):
+    """Lower and upper bounds of the expected deaths given the baseline.
+
+    `family` is either ``'poisson'`` (exact quantiles when :mod:`scipy` is
+    available) or ``'quasipoisson'``, in which case the dispersion `phi`
+    (see :func:`dispersion`) inflates the variance of the normal approximation.
+    """
+    base = np.asarray(base, dtype=float)
+    alpha = (1 - level) / 2
+    if family == 'poisson' and sstats is not None:
+        lower = sstats.poisson.ppf(alpha, base)
+        upper = sstats.poisson.ppf(1 - alpha, base)
+    elif family in ('poisson', 'quasipoisson'):
+        if family == 'quasipoisson' and phi is None:
+            raise IOError("Dispersion needs to be passed with the quasi-Poisson family")
+        var = base * (1. if family == 'poisson' else np.asarray(phi, dtype=float))
+        z = NormalDist().inv_cdf(1 - alpha)
+        lower, upper = base - z * np.sqrt(var), base + z * np.sqrt(var)
+    else:
+        raise IOError("Family '%s' not recognised - must be 'poisson' or 'quasipoisson'" % family)
+    return np.clip(lower, 0, None), upper
+
+
+#%% Excess
+
+def excess(current, base):
+    """Excess and relative increment (`rinc`) of the current counts over the baseline.
+    """
+    current, base = np.asarray(current, dtype=float), np.asarray(base, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rinc = np.where(base > 0, (current - base) / base, np.nan)
+    return current - base, rinc
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+.. _ITcube
+
+Dense count cube of IT daily death data.
+
+The raw ISTAT table holds one record per (comune, age class, day) with one
+column of counts per sex and year. The cube reshapes those counts once into a
+:class:`numpy.ndarray` of shape ``(area, [age,] year, day)`` so that every
+series of the dataset can be processed in a single vectorized call.
+
+**Dependencies**
+
+*require*:      :mod:`numpy`, :mod:`pandas`
+
+**Contents**
+"""
+
+# *since*:        Mon Oct 19 09:12:41 2026
+
+#%% Settings
+
+from os import path as osp
+import warnings
+
+from collections import OrderedDict
+import calendar
+
+try:
+    import numpy as np
+    import pandas as pd
+except:
+    raise IOError("Impossible to handle dataframe not available: abort...")
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+METAFILEITMORT  = osp.join(osp.dirname(__file__),
+                           '../metadata/ITmetadata-updated-comuni_giornaliero.json')
+
+YEAR = 2020
+YREF = 2000  # a leap year for sure
+
+SEXES = ('t', 'f', 'm')
+
+
+#%% Metadata helpers
+
+def load_meta(metafile = METAFILEITMORT):
+    with open(metafile, "r") as f:
+        return json.load(f)
+
+def colname(meta, key):
+    return meta.get('index')[key]['name']
+
+def count_columns(meta, sex = 't', years = None, columns = None):
+    # map every year to the name of its count column for the given sex, e.g.
+    # {2015: 'T_15', 2016: 'T_16', ...}
+    cols = OrderedDict()
+    for key, v in meta.get('index').items():
+        s, _, yy = key.partition('_')
+        if s != sex or not yy.isdigit():
+            continue
+        y = int('20%s' % yy)
+        if years is not None and y not in years:    continue
+        if columns is not None and v['name'] not in columns:  continue
+        cols.update({y: v['name']})
+    return OrderedDict(sorted(cols.items()))
+
+def day_position(ge):
+    # position (0-based, day of year in YREF) of the MMDD day strings of the
+    # data; conversion is run on the (at most 366) unique values only
+    codes, uniq = pd.factorize(pd.Series(ge).astype(str).str.zfill(4))
+    pos = pd.to_datetime(['%s%s' % (YREF, u) for u in uniq], format='%Y%m%d').dayofyear.values - 1
+    return pos[codes]
+
+def day_timeline(start, end):
+    return pd.date_range(start = pd.Timestamp(YREF, 1, 1) + pd.Timedelta(days=int(start)),
+                         periods = int(end) - int(start) + 1, freq = 'D')
+
+def day_timestamp(day):
+    # day given either as a MMDD string or as a datetime in YREF; None when empty
+    if day in (None, ''):       return None
+    if isinstance(day, str):    return pd.Timestamp('%s%s' % (YREF, day))
+    return day
+
+
+#%% Cube
+
+class DeathCube(object):
+    """Daily death counts stored as an array of shape ``(area, [age,] year, day)``.
+    """
+
+    def __init__(self, values, areas, years, days, ages = None, sex = 't',
+                 missing = None, level = None):
+        self.values = values
+        self.areas = areas      # dataframe of area attributes, indexed by area code
+        self.years = list(years)
+        self.days = days        # DatetimeIndex in YREF
+        self.ages = None if ages is None else list(ages)
+        self.sex = sex
+        self.missing = missing  # boolean (area, year): some counts not available
+        self.level = level
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def codes(self):
+        return self.areas.index
+
+    def year_index(self, years):
+        if np.isscalar(years):  return self.years.index(years)
+        return [self.years.index(y) for y in years]
+
+    def day_slice(self, start = None, end = None):
+        # start/end given either as MMDD strings or as datetimes in YREF
+        return self.days.slice_indexer(day_timestamp(start), day_timestamp(end))
+
+    def area_index(self, areas):
+        return self.areas.index.get_indexer(pd.Index(areas))
+
+    def _new(self, values, **kwargs):
+        attrs = dict(areas = self.areas, years = self.years, days = self.days,
+                     ages = self.ages, sex = self.sex, missing = self.missing,
+                     level = self.level)
+        attrs.update(kwargs)
+        return DeathCube(values, **attrs)
+
+    def sel(self, areas = None, ages = None, years = None, start = None, end = None):
+        values, attrs = self.values, {}
+        if areas is not None:
+            ia = self.area_index(areas)
+            if (ia < 0).any():
+                raise IOError("Areas not found in the cube: %s" % list(pd.Index(areas)[ia < 0]))
+            values = values[ia]
+            attrs.update(areas = self.areas.iloc[ia])
+            if self.missing is not None: attrs.update(missing = self.missing[ia])
+        if ages is not None:
+            if self.ages is None:
+                raise IOError("Cube has no age dimension")
+            iage = [self.ages.index(a) for a in ages]
+            values = values[:, iage]
+            attrs.update(ages = [self.ages[i] for i in iage])
+        if years is not None:
+            iy = self.year_index(years)
+            values = values[..., iy, :]
+            attrs.update(years = [self.years[i] for i in iy])
+            if attrs.get('missing', self.missing) is not None:
+                attrs.update(missing = attrs.get('missing', self.missing)[:, iy])
+        if start is not None or end is not None:
+            sl = self.day_slice(start, end)
+            values = values[..., sl]
+            attrs.update(days = self.days[sl])
+        return self._new(values, **attrs)
+
+    def collapse_ages(self, ages = None):
+        if self.ages is None:
+            return self
+        cube = self if ages is None else self.sel(ages = ages)
+        return self._new(cube.values.sum(axis=1), ages = None)
+
+    def aggregate(self, level):
+        # sum the comuni sharing the same value of the areas attribute `level`
+        # (e.g. 'PROV', 'REG'): areas are sorted by group once, then reduced
+        # with a single reduceat
+        groups = self.areas[level] if isinstance(level, str) else pd.Series(level, index=self.areas.index)
+        gcodes, guniq = pd.factorize(groups, sort=True)
+        order = np.argsort(gcodes, kind='stable')
+        starts = np.r_[0, np.flatnonzero(np.diff(gcodes[order])) + 1]
+        values = np.add.reduceat(self.values[order], starts, axis=0)
+        missing = None if self.missing is None else \
+            np.logical_or.reduceat(self.missing[order], starts, axis=0)
+        areas = self.areas.groupby(groups.values, sort=True).first()
+        # keep only those attributes that are constant within the groups
+        const = self.areas.groupby(groups.values, sort=True).nunique() <= 1
+        areas = areas.loc[:, const.all(axis=0)]
+        if groups.name is not None:
+            areas = areas.drop(columns = groups.name, errors = 'ignore')
+        areas.index = pd.Index(guniq, name = groups.name if isinstance(level, str) else None)
+        return self._new(values, areas = areas, missing = missing,
+                         level = level if isinstance(level, str) else None)
+
+    def last_day(self, year):
+        """Last day with some counts for `year`, None if there are none: days
+        beyond the coverage of the current release hold no death at all."""
+        values = self.values[..., self.year_index(year), :]
+        counts = values.reshape(-1, values.shape[-1]).sum(axis=0)
+        nonzero = np.flatnonzero(counts)
+        return self.days[nonzero[-1]] if len(nonzero) > 0 else None
+
+    def window(self, start = None, end = None):
+        # total counts over a window of days: array of shape (area, [age,] year)
+        return self.values[..., self.day_slice(start, end)].sum(axis=-1)
+
+    def cumulative(self):
+        return self._new(self.values.cumsum(axis=-1))
+
+    def to_frame(self, area = None, age = None):
+        # dataframe indexed by day with one column per year, i.e. the same
+        # layout as the `dailydeaths` tables of the script
+        values = self.values
+        if area is not None:
+            values = values[self.area_index([area])[0]]
+        else:
+            values = values.sum(axis=0)
+        if self.ages is not None:
+            values = values[self.ages.index(age)] if age is not None else values.sum(axis=0)
+        return pd.DataFrame(values.T, index = self.days, columns = self.years)
+
+    def __repr__(self):
+        return '<DeathCube sex=%s shape=%s years=%s days=[%s, %s]>' % \
+            (self.sex, self.values.shape, self.years,
+             self.days[0].strftime('%d/%m'), self.days[-1].strftime('%d/%m'))
+
+
+def build_cube(data, meta = None, sex = 't', by = None, age = False, years = None,
+               attributes = None, dtype = np.int32, pad_leapday = True):
+    """Reshape the raw table of counts into a :class:`DeathCube`.
+    """
+    if meta is None:
+        meta = load_meta()
+    DAY = colname(meta, 'date')
+    AGE = colname(meta, 'age')
+    by = by or colname(meta, 'city_code')
+    if attributes is None:
+        attributes = [colname(meta, k) for k in ('city', 'province', 'prov_code', 'region',
+                                                 'reg_code', 'city_type')]
+    attributes = [a for a in attributes if a in data.columns and a != by]
+
+    cols = count_columns(meta, sex = sex, years = years, columns = data.columns)
+    if cols == {}:
+        raise IOError("No count columns found in the data for sex '%s'" % sex)
+
+    acodes, auniq = pd.factorize(data[by], sort=True)
+    dpos = day_position(data[DAY])
+    dmin, dmax = dpos.min(), dpos.max()
+    nday, narea = dmax - dmin + 1, len(auniq)
+    if age is True:
+        ages = sorted(int(a) for a in meta.get('index')['age']['values'].keys())
+        iage = np.searchsorted(ages, data[AGE].astype(int).values)
+        nage = len(ages)
+    else:
+        ages, iage, nage = None, 0, 1
+    flat = (acodes * nage + iage) * nday + (dpos - dmin)
+
+    NAN = meta.get('nan')
+    values = np.zeros((narea, nage, len(cols), nday), dtype = dtype)
+    missing = np.zeros((narea, len(cols)), dtype = bool)
+    for iy, col in enumerate(cols.values()):
+        w = pd.to_numeric(data[col], errors='coerce').values.astype(float)
+        nan = np.isnan(w) | (w == NAN) if NAN is not None else np.isnan(w)
+        if nan.any():
+            w[nan] = 0
+            missing[:, iy] = np.bincount(acodes[nan], minlength = narea) > 0
+        values[:, :, iy, :] = np.bincount(flat, weights = w, minlength = narea * nage * nday) \
+            .reshape(narea, nage, nday)
+
+    days = day_timeline(dmin, dmax)
+    ileapday = days.get_indexer([pd.Timestamp(YREF, 2, 29)])[0]
+    if pad_leapday is True and ileapday > 0:
+        # as in the script: 29/02 of non leap years is padded with the 28/02 value
+        for iy, y in enumerate(cols.keys()):
+            if not calendar.isleap(y):
+                values[:, :, iy, ileapday] = values[:, :, iy, ileapday-1]
+
+    if age is not True:
+        values = values[:, 0]
+    areas = data.groupby(acodes, sort=True)[attributes].first() if attributes != [] \
+        else pd.DataFrame(index = range(narea))
+    areas.index = pd.Index(auniq, name = by)
+
+    if missing.any():
+        warnings.warn("Counts not available for %s areas - set to 0" % missing.any(axis=1).sum())
+    return DeathCube(values, areas, list(cols.keys()), days, ages = ages, sex = sex,
+                     missing = missing, level = by)
+
+
+def build_age_matrix(data, meta = None, sex = 't', by = None, years = None, pad_leapday = True):
+    """Sparse counterpart of the cube with ages, for areas as small as the comuni.
+
+    Most (comune, age class, day) cells are empty, so the counts are stored in
+    a :mod:`scipy.sparse` CSR matrix with one row per (area, age class) and one
+    column per (year, day). Returns the matrix together with the area codes,
+    age classes, years and days (in YREF) of its rows and columns.
+    """
+    try:
+        from scipy import sparse
+    except ImportError:
+        raise IOError("Package scipy not available: sparse age counts not supported")
+    if meta is None:
+        meta = load_meta()
+    DAY = colname(meta, 'date')
+    AGE = colname(meta, 'age')
+    by = by or colname(meta, 'city_code')
+    cols = count_columns(meta, sex = sex, years = years, columns = data.columns)
+    acodes, auniq = pd.factorize(data[by], sort=True)
+    dpos = day_position(data[DAY])
+    dmin, dmax = dpos.min(), dpos.max()
+    nday = dmax - dmin + 1
+    ages = sorted(int(a) for a in meta.get('index')['age']['values'].keys())
+    rows = acodes * len(ages) + np.searchsorted(ages, data[AGE].astype(int).values)
+    days = day_timeline(dmin, dmax)
+    ileapday = days.get_indexer([pd.Timestamp(YREF, 2, 29)])[0]
+
+    NAN = meta.get('nan')
+    irows, icols, counts = [], [], []
+    for iy, (y, col) in enumerate(cols.items()):
+        w = pd.to_numeric(data[col], errors='coerce').values.astype(float)
+        keep = ~np.isnan(w) & (w != 0) & (w != NAN if NAN is not None else True)
+        r, d, w = rows[keep], dpos[keep] - dmin, w[keep]
+        if pad_leapday is True and ileapday > 0 and not calendar.isleap(y):
+            r, d, w = r[d != ileapday], d[d != ileapday], w[d != ileapday]
+            prev = d == ileapday - 1
+            r, d, w = np.r_[r, r[prev]], np.r_[d, d[prev] + 1], np.r_[w, w[prev]]
+        irows.append(r), icols.append(iy * nday + d), counts.append(w)
+    matrix = sparse.csr_matrix((np.concatenate(counts), (np.concatenate(irows), np.concatenate(icols))),
+                               shape = (len(auniq) * len(ages), len(cols) * nday))
+    matrix.sum_duplicates()
+    return matrix, pd.Index(auniq, name = by), ages, list(cols.keys()), days
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+.. _ITexplore
+
+Interactive exploration of IT mortality data in notebooks.
+
+Selections of an area (at any level), a range of age classes, a sex and a
+window of days are answered from the counts pre-aggregated by
+:class:`ITservice.MortalityAggregates` and kept in an in-memory LRU cache, so
+that the raw table is never scanned again. The widgets (:mod:`ipywidgets`)
+redraw a single figure in place: the lines and the expected band are
+updated, not recreated. Every interaction is timed against a latency budget
+(100 ms by default).
+
+**Dependencies**
+
+*require*:      :mod:`numpy`, :mod:`pandas`
+
+*optional*:     :mod:`ipywidgets`, :mod:`matplotlib`, :mod:`scipy`
+
+**Contents**
+"""
+
+# *since*:        Mon Oct 19 12:31:09 2026
+
+#%% Settings
+
+import time
+
+from collections import OrderedDict, deque
+
+try:
+    import numpy as np
+    import pandas as pd
+except:
+    raise IOError("Impossible to handle dataframe not available: abort...")
+
+from ITlazy import lazy_import
+from ITcube import YEAR, YREF, SEXES, day_timestamp
+from ITbaseline import baseline, dispersion, expected_band
+from ITservice import LEVELS, CACHESIZE
+
+widgets = lazy_import('ipywidgets', msg = "Package ipywidgets not available: widgets not supported")
+mplt = lazy_import('matplotlib.pyplot', msg = "Package matplotlib not available: plots not supported")
+display = lazy_import('IPython.display', 'display', msg = "Package IPython not available: widgets not supported")
+
+BUDGET = 0.1    # latency budget of an interaction, in seconds
+
+
+#%% Explorer
+
+class Explorer(object):
+    """Answer the selections of the widgets from pre-aggregated counts.
+    """
+
+    def __init__(self, aggregates, method = 'mean', level = 0.95, year = YEAR,
+                 cachesize = CACHESIZE, budget = BUDGET):
+        self.aggregates = aggregates
+        self.method, self.level, self.year = method, level, year
+        self.cachesize, self.budget = cachesize, budget
+        self._cache = OrderedDict()
+        self.latencies = deque(maxlen = 1000)
+
+    def _counts(self, level, area, sex, ages):
+        # counts (year, day) of the area summed over the selected age classes
+        agg = self.aggregates
+        cube = agg.cube(level, sex)
+        if level == 'it' and area in (None, ''):   area = 'IT'
+        if ages is None:
+            return cube.values[agg._area(cube, area)], cube.years, cube.days
+        if level == 'comune':
+            try:
+                matrix, codes, allages, years, days = agg.agematrix[sex]
+            except KeyError:
+                raise ValueError("Age profiles of comuni not available for sex '%s'" % sex)
+            ia = codes.get_indexer([area])[0]
+            if ia < 0:
+                raise KeyError("Area '%s' not found" % area)
+            rows = ia * len(allages) + np.flatnonzero(np.isin(allages, ages))
+            values = np.asarray(matrix[rows].sum(axis=0)).reshape(len(years), len(days))
+            return values, years, days
+        cube = agg.ages[(level, sex)]
+        iage = np.flatnonzero(np.isin(cube.ages, ages))
+        return cube.values[agg._area(cube, area)][iage].sum(axis=0), cube.years, cube.days
+
+    def select(self, level = 'prov', area = None, sex = 't', ages = None, start = None, end = None):
+        """Daily counts of all years in the window, with the baseline and the
+        bounds of the expected band, as a dataframe (day x column).
+        """
+        t0 = time.perf_counter()
+        key = (level, str(area), sex, None if ages is None else tuple(sorted(ages)), start, end)
+        try:
+            frame = self._cache.pop(key)
+        except KeyError:
+            values, years, days = self._counts(level, area, sex, ages)
+            values = np.asarray(values, dtype=float)
+            base = baseline(values, years, method = self.method, year = self.year)
+            phi = dispersion(values, years, year = self.year, pooled = True)
+            lower, upper = expected_band(base, level = self.level, family = 'quasipoisson', phi = phi)
+            frame = pd.DataFrame(values.T, index = days, columns = years)
+            frame['base'], frame['lower'], frame['upper'] = base, lower, upper
+            frame = frame.loc[day_timestamp(start):day_timestamp(end)]
+        self._cache[key] = frame
+        if len(self._cache) > self.cachesize:
+            self._cache.popitem(last = False)
+        self.latencies.append(time.perf_counter() - t0)
+        return frame
+
+    def summary(self, frame):
+        observed, expected = frame[self.year].sum(), frame['base'].sum()
+        return {'observed': observed, 'expected': expected, 'excess': observed - expected,
+                'rinc': (observed - expected) / expected if expected > 0 else np.nan}
+
+    def stats(self):
+        """Latency percentiles (in ms) of the selections answered so far."""
+        lat = np.array(self.latencies) * 1e3
+        if len(lat) == 0:
+            return {}
+        return {'n': len(lat), 'p50': np.percentile(lat, 50), 'p99': np.percentile(lat, 99),
+                'max': lat.max(), 'over': int((lat > self.budget * 1e3).sum())}
+
+    def bench(self, n = 200, seed = 0):
+        """Time `n` random selections, first uncached then cached; returns the
+        latency percentiles (in ms) of both passes.
+        """
+        rng = np.random.default_rng(seed)
+        agg, sels = self.aggregates, []
+        for _ in range(n):
+            level = LEVELS[rng.integers(len(LEVELS))]
+            codes = agg.cube(level).codes
+            a0 = int(rng.integers(0, 21))
+            d0 = int(rng.integers(0, 300))
+            days = pd.date_range(pd.Timestamp(YREF, 1, 1) + pd.Timedelta(days = d0), periods = 60)
+            sels.append(dict(level = level, area = codes[rng.integers(len(codes))],
+                             sex = SEXES[rng.integers(len(SEXES))],
+                             ages = None if rng.random() < 0.5 else list(range(a0, a0 + int(rng.integers(1, 6)))),
+                             start = days[0].strftime('%m%d'), end = days[-1].strftime('%m%d')))
+        out, self._cache = {}, OrderedDict()
+        for npass in ('cold', 'warm'):
+            self.latencies.clear()
+            for sel in sels:
+                self.select(**sel)
+            out[npass] = self.stats()
+        return pd.DataFrame(out).T
+
+    #%% Widgets
+
+    def widgets(self, level = 'prov', area = None, sex = 't', start = None, end = None):
+        """Build the selectors and the figure; selections redraw the figure in place.
+        """
+        agg = self.aggregates
+        agelabels = agg.agelabels
+        nage = len(agelabels)
+        days = agg.cube(level, sex).days
+        doptions = [(d.strftime('%d/%m'), d.strftime('%m%d')) for d in days]
+        start, end = start or doptions[0][1], end or doptions[-1][1]
+
+        wlevel = widgets.Dropdown(options = list(LEVELS), value = level, description = 'Level')
+        warea = widgets.Dropdown(options = self._area_options(level), description = 'Area')
+        if area is not None:
+            warea.value = area
+        wsex = widgets.ToggleButtons(options = [('total', 't'), ('females', 'f'), ('males', 'm')],
+                                     value = sex, description = 'Sex')
+        wages = widgets.SelectionRangeSlider(options = [(agelabels[str(a)], a) for a in range(nage)],
+                                             index = (0, nage - 1), description = 'Ages')
+        wwindow = widgets.SelectionRangeSlider(options = doptions, value = (start, end),
+                                               description = 'Days', layout = {'width': '600px'})
+        info = widgets.HTML()
+
+        fig, ax = mplt.subplots(1, figsize = (10, 5))
+        mplt.close(fig)  # displayed through the output widget only
+        years = agg.cube(level, sex).years
+        lines = {y: ax.plot([], [], lw = 2 if y == self.year else 0.8,
+                            color = 'k' if y == self.year else None, label = str(y))[0] for y in years}
+        baseline_line, = ax.plot([], [], 'b--', lw = 1, label = 'baseline')
+        band = [None]
+        ax.legend(loc = 'upper left', fontsize = 'small')
+        ax.grid(lw = 0.1)
+        out = widgets.Output()
+        interactive = 'widget' in mplt.get_backend().lower() or 'ipympl' in mplt.get_backend().lower()
+
+        def redraw(*args):
+            t0 = time.perf_counter()
+            ages = list(range(wages.value[0], wages.value[1] + 1))
+            try:
+                frame = self.select(level = wlevel.value, area = warea.value, sex = wsex.value,
+                                    ages = None if len(ages) == nage else ages,
+                                    start = wwindow.value[0], end = wwindow.value[1])
+            except (KeyError, ValueError) as e:
+                info.value = '<b>%s</b>' % e
+                return
+            x = frame.index
+            for y, line in lines.items():
+                line.set_data(x, frame[y].values)
+            baseline_line.set_data(x, frame['base'].values)
+            if band[0] is not None:
+                band[0].remove()
+            band[0] = ax.fill_between(x, frame['lower'].values, frame['upper'].values,
+                                      color = 'b', alpha = 0.15, lw = 0)
+            ax.relim()
+            ax.autoscale_view()
+            ax.set_title('%s - %s' % (warea.label, wsex.label), fontsize = 'medium')
+            if interactive:
+                fig.canvas.draw_idle()
+            else:
+                with out:
+                    out.clear_output(wait = True)
+                    display(fig)
+            s = self.summary(frame)
+            info.value = 'observed: <b>%d</b> - expected: <b>%.0f</b> - excess: <b>%.0f</b> (%+.1f%%)' \
+                ' - %.0f ms' % (s['observed'], s['expected'], s['excess'], 100 * s['rinc'],
+                                (time.perf_counter() - t0) * 1e3)
+
+        def relevel(change):
+            warea.unobserve(redraw, 'value')
+            warea.options = self._area_options(wlevel.value)
+            warea.observe(redraw, 'value')
+            redraw()
+
+        wlevel.observe(relevel, 'value')
+        for w in (warea, wsex, wages, wwindow):
+            w.observe(redraw, 'value')
+        if interactive:
+            with out:
+                display(fig.canvas)
+        redraw()
+        return widgets.VBox([widgets.HBox([wlevel, warea]), wsex, wages, wwindow, info, out])
+
+    def _area_options(self, level):
+        areas = self.aggregates.areas(level)
+        names = [c for c in areas.columns if areas[c].dtype == object or pd.api.types.is_string_dtype(areas[c])]
+        if names == [] or level == 'it':
+            return [(str(c), c) for c in areas.index]
+        return sorted([('%s (%s)' % (n, c), c) for c, n in zip(areas.index, areas[names[0]])])
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+.. _ITindex
+
+Secondary indexes over the low-cardinality fields of the IT mortality table.
+
+Boolean filters such as ``data[PROV]==code & data[CL_ETA].isin(ages)`` scan
+the whole table for every predicate. The index instead keeps, for every
+indexed field, the codes of the rows and the sorted list of rows holding each
+value (posting lists, obtained from one stable argsort). A combined predicate
+starts from the smallest selection and filters it with the codes of the other
+fields, so that its cost is proportional to the number of selected rows. The
+selection is then reused by all the per-year/per-sex aggregations.
+
+**Dependencies**
+
+*require*:      :mod:`numpy`, :mod:`pandas`
+
+**Contents**
+"""
+
+# *since*:        Mon Oct 19 12:22:29 2026
+
+#%% Settings
+
+try:
+    import numpy as np
+    import pandas as pd
+except:
+    raise IOError("Impossible to handle dataframe not available: abort...")
+
+from ITcube import load_meta, colname
+
+INDEXED = ('prov_code', 'reg_code', 'age', 'city_type', 'date', 'city_code')
+
+
+#%% Index
+
+class RowIndex(object):
+    """Posting-list index of the rows of `data` over the given fields.
+
+    Predicates are passed as a dictionary (or keywords) mapping a field to:
+
+    * a scalar: equality;
+    * a list, set or range: membership;
+    * a 2-tuple ``(low, high)``: values between `low` and `high`, inclusive
+      (e.g. days ``('0301', '0321')`` in ``MMDD`` format).
+    """
+
+    def __init__(self, data, columns = None, meta = None):
+        if columns is None:
+            meta = meta or load_meta()
+            columns = [colname(meta, k) for k in INDEXED]
+        self.data = data
+        self.nrows = len(data)
+        self.codes, self.uniques, self.order, self.offsets = {}, {}, {}, {}
+        for col in columns:
+            if col not in data.columns:
+                continue
+            codes, uniq = pd.factorize(data[col], sort=True)
+            codes = codes.astype(np.int32)
+            self.codes[col] = codes
+            self.uniques[col] = pd.Index(uniq)
+            # rows holding the k-th value: order[offsets[k]:offsets[k+1]], sorted
+            self.order[col] = np.argsort(codes, kind='stable').astype(np.int32)
+            self.offsets[col] = np.r_[0, np.cumsum(np.bincount(codes, minlength=len(uniq)))]
+        self._values = {}
+
+    @property
+    def columns(self):
+        return list(self.codes.keys())
+
+    def _allowed(self, col, value):
+        # boolean table over the unique values of the field
+        uniq = self.uniques[col]
+        if isinstance(value, tuple) and len(value) == 2:
+            low, high = value
+            allowed = np.zeros(len(uniq), dtype=bool)
+            allowed[uniq.searchsorted(low, side='left'):uniq.searchsorted(high, side='right')] = True
+            return allowed
+        elif isinstance(value, (list, set, range, np.ndarray, pd.Index, pd.Series)):
+            return uniq.isin(list(value))
+        return np.asarray(uniq == value)
+
+    def _postings(self, col, allowed):
+        off, order = self.offsets[col], self.order[col]
+        codes = np.flatnonzero(allowed)
+        if len(codes) == 0:
+            return np.array([], dtype=np.int32)
+        # contiguous runs of codes map onto contiguous slices of the postings
+        breaks = np.flatnonzero(np.diff(codes) > 1) + 1
+        starts, ends = codes[np.r_[0, breaks]], codes[np.r_[breaks - 1, len(codes) - 1]]
+        rows = [order[off[s]:off[e+1]] for s, e in zip(starts, ends)]
+        return rows[0] if len(rows) == 1 and len(codes) == 1 else np.sort(np.concatenate(rows))
+
+    def rows(self, where = None, **kwargs):
+        """Sorted positions of the rows satisfying all the predicates.
+        """
+        where = dict(where or {}, **kwargs)
+        if where == {}:
+            return np.arange(self.nrows, dtype=np.int32)
+        unknown = [c for c in where if c not in self.codes]
+        if unknown != []:
+            raise IOError("Fields %s not indexed" % unknown)
+        tables = {col: self._allowed(col, v) for col, v in where.items()}
+        sizes = {col: np.diff(self.offsets[col])[t].sum() for col, t in tables.items()}
+        first = min(sizes, key=sizes.get)
+        rows = self._postings(first, tables[first])
+        for col, table in tables.items():
+            if col != first:
+                rows = rows[table[self.codes[col][rows]]]
+        return rows
+
+    def mask(self, where = None, **kwargs):
+        mask = np.zeros(self.nrows, dtype=bool)
+        mask[self.rows(where, **kwargs)] = True
+        return mask
+
+    def select(self, where = None, **kwargs):
+        return self.data.iloc[self.rows(where, **kwargs)]
+
+    def _column(self, col):
+        if col not in self._values:
+            self._values[col] = pd.to_numeric(self.data[col], errors='coerce').fillna(0).to_numpy()
+        return self._values[col]
+
+    def sum(self, rows, by, columns, observed = True):
+        """Sum of `columns` over the selected rows grouped by the indexed field
+        `by`, i.e. ``data.iloc[rows].groupby(by)[columns].sum()``.
+
+        With `observed` set, only the groups present in the selection are
+        returned (as :meth:`pandas.DataFrame.groupby` does), otherwise all the
+        values of the field are.
+        """
+        single = isinstance(columns, str)
+        cols = [columns] if single else list(columns)
+        codes, uniq = self.codes[by][rows], self.uniques[by]
+        out = pd.DataFrame({c: np.bincount(codes, weights=self._column(c)[rows], minlength=len(uniq))
+                            for c in cols}, index=uniq.rename(by))
+        for c in cols:
+            if np.issubdtype(self.data[c].dtype, np.integer):
+                out[c] = out[c].astype(self.data[c].dtype)
+        if observed is True:
+            out = out.iloc[np.flatnonzero(np.bincount(codes, minlength=len(uniq)))]
+        return out[columns] if single else out
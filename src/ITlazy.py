@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+.. _ITlazy
+
+Lazy import of the heavy optional dependencies, and import-time benchmark.
+
+Plotting (:mod:`matplotlib`), geographical (:mod:`geopandas` through
+:mod:`pyeudatnat`) and statistical (:mod:`scipy`) packages are only imported
+the first time they are actually used, so that compute-only workers start
+fast and run with :mod:`numpy`/:mod:`pandas` only.
+
+Run as a script, the module measures the cold import time of other modules in
+fresh interpreters and exits with an error when a budget is exceeded, or when
+heavy packages get imported eagerly::
+
+    python ITlazy.py ITcube ITbaseline ITsignif --budget 1.5
+
+**Dependencies**
+
+*require*:      :mod:`importlib`
+
+**Contents**
+"""
+
+# *since*:        Mon Oct 19 12:21:15 2026
+
+#%% Settings
+
+import sys
+import importlib
+from importlib import util as imputil
+import subprocess
+
+HEAVY = ('matplotlib', 'geopandas', 'shapely', 'pyeudatnat', 'scipy')
+
+BUDGET = 1.5    # seconds
+
+
+#%% Lazy import
+
+def is_available(name):
+    # check that a package is installed without importing it
+    try:
+        return imputil.find_spec(name.split('.')[0]) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+class LazyImport(object):
+    """Proxy of a module (or of an attribute of a module) imported on first use.
+
+    A missing package only raises (an :class:`IOError` with message `msg`) when
+    the proxy is first used, not when it is defined.
+    """
+
+    def __init__(self, name, attr = None, msg = None):
+        self.__dict__.update(_name = name, _attr = attr, _msg = msg, _obj = None)
+
+    def _load(self):
+        if self._obj is None:
+            try:
+                obj = importlib.import_module(self._name)
+            except ImportError:
+                raise IOError(self._msg or "Package %s not available: abort..." % self._name)
+            if self._attr is not None:
+                obj = getattr(obj, self._attr)
+            self.__dict__['_obj'] = obj
+        return self._obj
+
+    @property
+    def loaded(self):
+        return self._obj is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __repr__(self):
+        return '<lazy %s%s%s>' % (self._name, '' if self._attr is None else '.%s' % self._attr,
+                                  '' if self._obj is None else ' (loaded)')
+
+def lazy_import(name, attr = None, msg = None):
+    return LazyImport(name, attr = attr, msg = msg)
+
+
+#%% Import-time benchmark
+
+def import_time(module, repeat = 5, path = None):
+    """Best wall time (in seconds) of a cold import of `module`, each run in a
+    fresh interpreter, together with the heavy packages it imported.
+    """
+    code = ("import sys, time; t = time.perf_counter(); import %s; "
+            "print(time.perf_counter() - t); "
+            "print(' '.join(m for m in %r if m in sys.modules))") % (module, HEAVY)
+    best, heavy = None, []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], cwd = path, check = True,
+                             capture_output = True, text = True).stdout.splitlines()
+        t, heavy = float(out[0]), out[1].split() if len(out) > 1 else []
+        best = t if best is None else min(best, t)
+    return best, heavy
+
+def bench_import(modules, budget = BUDGET, repeat = 5, path = None):
+    """Check the cold import of every module against the budget; returns the
+    list of failures (empty when all pass).
+    """
+    failures = []
+    for module in modules:
+        t, heavy = import_time(module, repeat = repeat, path = path)
+        status = 'ok'
+        if t > budget:
+            status = 'FAIL (budget %.2fs)' % budget
+        if heavy != []:
+            status = 'FAIL (eager import of %s)' % ', '.join(heavy)
+        if status != 'ok':
+            failures.append(module)
+        print('%-14s %.3fs  %s' % (module, t, status))
+    return failures
+
+
+if __name__ == '__main__':
+    import argparse
+    import glob
+    from os import path as osp
+    here = osp.dirname(osp.abspath(__file__))
+    # all the modules next to this one, but the analysis script itself
+    modules = sorted(osp.splitext(osp.basename(f))[0] for f in glob.glob(osp.join(here, 'IT*.py')))
+    modules = [m for m in modules if m != 'ITmortality']
+    parser = argparse.ArgumentParser(description = 'Cold import-time benchmark')
+    parser.add_argument('modules', nargs = '*', default = modules)
+    parser.add_argument('--budget', default = BUDGET, type = float, help = 'seconds per module')
+    parser.add_argument('--repeat', default = 5, type = int)
+    args = parser.parse_args()
+    failures = bench_import(args.modules, budget = args.budget, repeat = args.repeat,
+                            path = here)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+.. _ITmapcache
+
+Cache of pre-rendered choropleth tiles of IT municipalities.
+
+The map of the comuni is split into ``2**zoom x 2**zoom`` tiles (zoom 0 being
+the whole country, i.e. the map of Figure 7'). Every tile is rendered once per
+metric, date window and styling, and stored in a cache evicted by size. The
+key of a tile includes a digest of the values of the comuni it shows, so that
+a new release of the data only triggers the rendering of the tiles whose
+comuni actually changed.
+
+**Dependencies**
+
+*require*:      :mod:`numpy`, :mod:`pandas`, :mod:`geopandas`, :mod:`matplotlib`
+
+**Contents**
+"""
+
+# *since*:        Mon Oct 19 12:20:09 2026
+
+#%% Settings
+
+import os
+from os import path as osp
+import io
+import hashlib
+
+from collections import OrderedDict
+
+try:
+    import numpy as np
+    import pandas as pd
+except:
+    raise IOError("Impossible to handle dataframe not available: abort...")
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+TILESIZE = 256          # pixels
+MAXBYTES = 256 * 2**20  # size of the cache
+
+STYLE = {'cmap':        'viridis',
+         'vmin':        None,
+         'vmax':        None,
+         'edgecolor':   'none',
+         'missing':     'lightgrey'}
+
+
+def _digest(*args):
+    h = hashlib.sha1()
+    for a in args:
+        h.update(a if isinstance(a, bytes) else json.dumps(a, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+#%% Cache
+
+class TileCache(object):
+    """Least recently used store of rendered tiles, evicted by total size in bytes.
+
+    Tiles are kept in memory, and also written to `root` when given so that
+    they survive restarts.
+    """
+
+    def __init__(self, maxbytes = MAXBYTES, root = None):
+        self.maxbytes = maxbytes
+        self.root = root
+        self.nbytes = 0
+        self._tiles = OrderedDict()
+        if self.root is not None:
+            os.makedirs(self.root, exist_ok=True)
+            for f in sorted(os.listdir(self.root), key=lambda f: osp.getmtime(osp.join(self.root, f))):
+                if f.endswith('.png'):
+                    # lazily read from disk: only the size is kept
+                    self._tiles[f[:-4]] = osp.getsize(osp.join(self.root, f))
+                    self.nbytes += self._tiles[f[:-4]]
+            self._evict()
+
+    def __contains__(self, key):
+        return key in self._tiles
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def get(self, key):
+        tile = self._tiles.pop(key)     # KeyError when missing
+        if isinstance(tile, int):
+            try:
+                with open(osp.join(self.root, '%s.png' % key), 'rb') as f:
+                    tile = f.read()
+            except OSError:
+                # file deleted behind the cache: a miss, rendered again
+                self.nbytes -= tile
+                raise KeyError(key)
+        self._tiles[key] = tile
+        return tile
+
+    def put(self, key, tile):
+        if key in self._tiles:
+            old = self._tiles.pop(key)
+            self.nbytes -= old if isinstance(old, int) else len(old)
+        self._tiles[key] = tile
+        self.nbytes += len(tile)
+        if self.root is not None:
+            with open(osp.join(self.root, '%s.png' % key), 'wb') as f:
+                f.write(tile)
+        self._evict()
+        return tile
+
+    def _evict(self):
+        while self.nbytes > self.maxbytes and len(self._tiles) > 1:
+            key, tile = self._tiles.popitem(last = False)
+            if self.root is not None:
+                try:                os.remove(osp.join(self.root, '%s.png' % key))
+                except OSError:     pass
+            self.nbytes -= tile if isinstance(tile, int) else len(tile)
+
+
+#%% Tiles
+
+class ChoroplethTiles(object):
+    """Choropleth tiles of a metric (e.g. `rinc`) over the comuni of `geodata`.
+    """
+
+    def __init__(self, geodata, code = 'PRO_COM_T', cache = None, tilesize = TILESIZE):
+        self.geodata = geodata.reset_index(drop = True)
+        self.codes = pd.Index(self.geodata[code])
+        self.cache = cache if cache is not None else TileCache()
+        self.tilesize = tilesize
+        self.bounds = self.geodata.total_bounds   # minx, miny, maxx, maxy
+        self._members = {}
+
+    def tile_bounds(self, zoom, x, y):
+        # tile (0,0) is the upper left one
+        minx, miny, maxx, maxy = self.bounds
+        n = 2**zoom
+        w, h = (maxx - minx) / n, (maxy - miny) / n
+        return minx + x*w, maxy - (y+1)*h, minx + (x+1)*w, maxy - y*h
+
+    def members(self, zoom):
+        """Positions of the comuni intersecting every tile at the given zoom level.
+
+        Tiles spanned by the bounding box of every polygon are computed at once
+        from the bounds of the geometries.
+        """
+        if zoom in self._members:
+            return self._members[zoom]
+        n = 2**zoom
+        minx, miny, maxx, maxy = self.bounds
+        b = self.geodata.geometry.bounds.values
+        tx = np.clip(((b[:, [0, 2]] - minx) / (maxx - minx) * n).astype(int), 0, n-1)
+        ty = np.clip(((maxy - b[:, [3, 1]]) / (maxy - miny) * n).astype(int), 0, n-1)
+        nx, ny = tx[:, 1] - tx[:, 0] + 1, ty[:, 1] - ty[:, 0] + 1
+        rows = np.repeat(np.arange(len(b)), nx * ny)
+        k = np.arange(len(rows)) - np.repeat(np.cumsum(nx * ny) - nx * ny, nx * ny)
+        x, y = tx[rows, 0] + k % nx[rows], ty[rows, 0] + k // nx[rows]
+        order = np.lexsort((rows, y, x))
+        x, y, rows = x[order], y[order], rows[order]
+        cuts = np.flatnonzero(np.diff(x * n + y)) + 1
+        members = {(int(x[i]), int(y[i])): r for i, r in zip(np.r_[0, cuts], np.split(rows, cuts))}
+        self._members.update({zoom: members})
+        return members
+
+    def tiles(self, zoom):
+        return list(self.members(zoom).keys())
+
+    def _style(self, values, style):
+        style = dict(STYLE, **(style or {}))
+        v = np.asarray(values, dtype=float)
+        v = v[np.isfinite(v)]
+        # normalization is shared by all tiles so that they fit together
+        if style['vmin'] is None:   style['vmin'] = float(np.percentile(v, 2)) if len(v) else 0.
+        if style['vmax'] is None:   style['vmax'] = float(np.percentile(v, 98)) if len(v) else 1.
+        return style
+
+    def key(self, values, zoom, x, y, metric = '', window = None, style = None):
+        rows = self.members(zoom).get((x, y), np.array([], dtype=int))
+        v = values.values[rows].astype(float) if rows.size else np.array([])
+        return _digest(metric, window, zoom, x, y, self.tilesize, style, v.tobytes())
+
+    def render(self, values, zoom, x, y, style):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        rows = self.members(zoom).get((x, y), np.array([], dtype=int))
+        fig = Figure(figsize = (1, 1), dpi = self.tilesize)
+        FigureCanvasAgg(fig)
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.set_axis_off()
+        if rows.size:
+            gdf = self.geodata.iloc[rows].assign(_value = values.values[rows])
+            gdf.plot(column = '_value', ax = ax, cmap = style['cmap'], vmin = style['vmin'],
+                     vmax = style['vmax'], edgecolor = style['edgecolor'],
+                     missing_kwds = {'color': style['missing']})
+        # geopandas fixes an equal aspect: the tile would not fill its bounds
+        ax.set_aspect('auto')
+        minx, miny, maxx, maxy = self.tile_bounds(zoom, x, y)
+        ax.set_xlim(minx, maxx), ax.set_ylim(miny, maxy)
+        buf = io.BytesIO()
+        fig.savefig(buf, format = 'png', transparent = True)
+        return buf.getvalue()
+
+    def tile(self, values, zoom = 0, x = 0, y = 0, metric = '', window = None, style = None):
+        """PNG image of one tile, rendered only when not already in the cache.
+
+        `values` is a series of the metric indexed by comune code. Unless `vmin`
+        and `vmax` are fixed in the `style`, they are derived from the values of
+        all comuni, hence any change of the data invalidates all the tiles.
+        """
+        values = values.reindex(self.codes)
+        style = self._style(values, style)
+        key = self.key(values, zoom, x, y, metric = metric, window = window, style = style)
+        try:
+            return self.cache.get(key)
+        except KeyError:
+            return self.cache.put(key, self.render(values, zoom, x, y, style))
+
+    def prerender(self, values, zoom = 0, metric = '', window = None, style = None):
+        """Render all the (non empty) tiles of a zoom level; returns the number of
+        tiles actually rendered, i.e. not found in the cache.
+        """
+        values = values.reindex(self.codes)
+        style = self._style(values, style)
+        nrendered = 0
+        for (x, y) in self.tiles(zoom):
+            key = self.key(values, zoom, x, y, metric = metric, window = window, style = style)
+            if key not in self.cache:
+                self.cache.put(key, self.render(values, zoom, x, y, style))
+                nrendered += 1
+        return nrendered
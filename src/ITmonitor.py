@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+.. _ITmonitor
+
+Online detection of anomalous daily deaths in IT mortality data.
+
+Every series of a :class:`ITcube.DeathCube` (comuni, provinces, age bands,
+...) is monitored against its 2015-2019 baseline with three detectors
+updated day by day:
+
+* a one-sided CUSUM of the standardised counts,
+* an EWMA of the standardised counts,
+* a Farrington-like test of the count of the day against the upper tail of
+  the overdispersed (negative binomial) baseline distribution.
+
+The state of the detectors holds a few numbers per series, whatever the
+number of days processed, so that newly ingested days update the state without
+recomputing the past. The state, together with the baseline it refers to, is
+persisted to disk and reloaded by the next ingestion.
+
+**Dependencies**
+
+*require*:      :mod:`numpy`, :mod:`pandas`
+
+*optional*:     :mod:`scipy`
+
+**Contents**
+"""
+
+# *since*:        Mon Oct 19 12:26:48 2026
+
+#%% Settings
+
+import os
+from os import path as osp
+
+try:
+    import numpy as np
+    import pandas as pd
+except:
+    raise IOError("Impossible to handle dataframe not available: abort...")
+
+from ITcube import YEAR, YREF, day_timeline
+from ITbaseline import baseline, dispersion
+from ITsignif import upper_pvalue
+
+DETECTORS = ('cusum', 'ewma', 'farrington')
+
+CALENDAR = day_timeline(0, 365)     # all the days of YREF
+
+
+#%% Monitor
+
+class Monitor(object):
+    """Online CUSUM/EWMA/Farrington-like detectors over many series at once.
+
+    `base` (series x day) holds the expected daily deaths and `phi` (series)
+    the dispersion of every series; `keys` identifies the series (area codes,
+    or (area, age) pairs) and `days` the day axis of `base`, by default the
+    whole calendar. Days whose baseline is not known yet (nan) are filled in
+    from the reference years of the later releases (see :meth:`update_cube`),
+    estimated with the `method`, `ref` and `smooth` parameters of :func:`expected`.
+
+    Parameters of the detectors: allowance `k` and decision threshold `h` of
+    the CUSUM, smoothing `lam` and width `L` (in asymptotic standard
+    deviations) of the EWMA, level `alpha` of the Farrington-like test.
+    """
+
+    def __init__(self, base, phi, keys, days = CALENDAR, year = YEAR, k = 0.5, h = 4., lam = 0.2,
+                 L = 3., alpha = 0.001, method = 'mean', ref = None, smooth = 7):
+        self.base = np.asarray(base, dtype=float)
+        self.phi = np.asarray(phi, dtype=float).ravel()
+        self.keys = keys
+        self.days = pd.DatetimeIndex(days)
+        if self.base.shape != (len(self.keys), len(self.days)):
+            raise IOError("Baseline of shape %s does not match %s series x %s days"
+                          % (self.base.shape, len(self.keys), len(self.days)))
+        self.year = year
+        self.params = dict(k = k, h = h, lam = lam, L = L, alpha = alpha)
+        self.estimator = dict(method = method, ref = None if ref is None else list(ref), smooth = smooth)
+        n = len(self.keys)
+        # state of the detectors: O(1) per series
+        self.day = -1                           # position of the last processed day
+        self.cusum = np.zeros(n)
+        self.ewma = np.zeros(n)
+        self.observed = np.zeros(n)             # counts, z-scores and p-values of the last day
+        self.z = np.full(n, np.nan)
+        self.pvalue = np.full(n, np.nan)
+        self.onset = np.full(n, -1, dtype=np.int32)  # first day of the current alarm
+
+    @property
+    def last(self):
+        return None if self.day < 0 else self.days[self.day]
+
+    def _position(self, day):
+        if isinstance(day, str):
+            day = pd.Timestamp('%s%s' % (YREF, day))
+        return self.days.get_loc(pd.Timestamp(day).replace(year = YREF))
+
+    def update(self, counts, day = None):
+        """Update the detectors with the counts of all the series on `day`
+        (MMDD string or datetime; default: the day following the last one
+        processed). `counts` may also hold several consecutive days on its
+        last axis. Returns the current alerts (see :meth:`alerts`).
+        """
+        counts = np.asarray(counts, dtype=float).reshape(len(self.keys), -1)
+        start = self.day + 1 if day is None else self._position(day)
+        if start <= self.day:
+            raise IOError("Day %s already processed (last: %s)"
+                          % (self.days[start].strftime('%d/%m'), self.last.strftime('%d/%m')))
+        elif start > self.day + 1:
+            raise IOError("Days missing between %s and %s"
+                          % (self.last.strftime('%d/%m') if self.last is not None else 'start',
+                             self.days[start].strftime('%d/%m')))
+        elif start + counts.shape[1] > len(self.days):
+            raise IOError("Counts beyond the last day of the baseline")
+        elif np.isnan(self.base[:, start:start + counts.shape[1]]).all(axis=0).any():
+            raise IOError("Baseline not available for some of the days from %s"
+                          % self.days[start].strftime('%d/%m'))
+        k, h, lam, L, alpha = [self.params[p] for p in ('k', 'h', 'lam', 'L', 'alpha')]
+        thresh = L * np.sqrt(lam / (2 - lam))
+        for j in range(counts.shape[1]):
+            t = start + j
+            y, mu = counts[:, j], self.base[:, t]
+            valid = mu > 0
+            with np.errstate(divide='ignore', invalid='ignore'):
+                z = np.where(valid, (y - mu) / np.sqrt(mu * self.phi), np.nan)
+            # series with no expected deaths keep their state
+            self.cusum = np.where(valid, np.maximum(0, self.cusum + z - k), self.cusum)
+            self.ewma = np.where(valid, lam * z + (1 - lam) * self.ewma, self.ewma)
+            self.pvalue = upper_pvalue(y, mu, family = 'negbin', phi = self.phi)
+            self.observed, self.z = y, z
+            alarm = (self.cusum > h) | (self.ewma > thresh) | (self.pvalue < alpha)
+            self.onset = np.where(alarm, np.where(self.onset < 0, t, self.onset), -1)
+            self.day = t
+        return self.alerts()
+
+    def update_cube(self, cube, end = None):
+        """Feed the days of `year` in `cube` that follow the last day processed,
+        up to `end` (MMDD or datetime; default: the last day with counts of
+        `year`, see :meth:`ITcube.DeathCube.last_day`).
+
+        The baseline of the days not covered by the previous releases is
+        first estimated from the reference years of `cube`.
+        """
+        if end is None:
+            end = cube.last_day(self.year)
+            if end is None:
+                return self.alerts()
+        sl = cube.day_slice(None, end)
+        days = cube.days[sl]
+        pos = self.days.get_indexer(days)
+        new = pos > self.day
+        if not new.any():
+            return self.alerts()
+        ipos = self._align(cube)
+        unknown = np.isnan(self.base[:, pos]).all(axis=0)
+        if unknown.any():
+            base, _, _ = expected(cube, year = self.year, **self.estimator)
+            self.base[:, pos[unknown]] = base[ipos][:, sl][:, unknown]
+        if cube.ages is not None:
+            values = cube.values[:, :, cube.year_index(self.year)].reshape(-1, len(cube.days))
+        else:
+            values = cube.values[:, cube.year_index(self.year)]
+        return self.update(values[ipos][:, sl][:, new], day = days[new][0])
+
+    def _align(self, cube):
+        keys = cube.codes if cube.ages is None else \
+            pd.MultiIndex.from_product([cube.codes, cube.ages])
+        ipos = keys.get_indexer(self.keys)
+        if np.any(ipos < 0):
+            raise IOError("Series of the monitor missing from the cube")
+        return ipos
+
+    def severity(self):
+        """Largest ratio of the detectors statistics over their alarm thresholds;
+        a series is in alarm when its severity exceeds 1.
+        """
+        p = self.params
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sev = np.vstack([self.cusum / p['h'],
+                             self.ewma / (p['L'] * np.sqrt(p['lam'] / (2 - p['lam']))),
+                             np.log10(self.pvalue) / np.log10(p['alpha'])])
+        return pd.DataFrame(sev.T, index = self.keys, columns = DETECTORS)
+
+    def alerts(self, all = False):
+        """Series currently in alarm (all of them if `all` is set), ranked by decreasing severity.
+        """
+        sev = self.severity()
+        table = pd.DataFrame({'observed':   self.observed,
+                              'expected':   self.base[:, self.day] if self.day >= 0 else np.nan,
+                              'z':          self.z,
+                              'cusum':      self.cusum,
+                              'ewma':       self.ewma,
+                              'pvalue':     self.pvalue,
+                              'severity':   sev.max(axis=1, skipna=True).values,
+                              'detector':   sev.fillna(-np.inf).idxmax(axis=1).values,
+                              'onset':      self.days[np.maximum(self.onset, 0)].where(self.onset >= 0),
+                              }, index = self.keys)
+        if all is False:
+            table = table[self.onset >= 0]
+        return table.sort_values('severity', ascending = False)
+
+    #%% Persistence
+
+    def save(self, fname):
+        dirname = osp.dirname(fname)
+        if dirname != '':
+            os.makedirs(dirname, exist_ok=True)
+        keys = self.keys.to_frame(index = False)
+        tmp = fname + '.tmp.npz'
+        np.savez(tmp, base = self.base, phi = self.phi, days = self.days.values,
+                 year = self.year, day = self.day, cusum = self.cusum, ewma = self.ewma,
+                 observed = self.observed, z = self.z, pvalue = self.pvalue, onset = self.onset,
+                 keynames = np.asarray([str(n) for n in keys.columns]),
+                 params = np.asarray([self.params[p] for p in ('k', 'h', 'lam', 'L', 'alpha')]),
+                 method = self.estimator['method'], smooth = self.estimator['smooth'],
+                 ref = np.asarray(self.estimator['ref'] or [], dtype=int),
+                 **{'key%s' % i: keys[c].to_numpy() if pd.api.types.is_numeric_dtype(keys[c])
+                                 else keys[c].astype(str).to_numpy(dtype = str)
+                    for i, c in enumerate(keys.columns)})
+        os.replace(tmp, fname)
+
+    @classmethod
+    def load(cls, fname):
+        with np.load(fname) as f:
+            names = list(f['keynames'])
+            arrays = [f['key%s' % i] for i in range(len(names))]
+            keys = pd.Index(arrays[0], name = names[0]) if len(names) == 1 else \
+                pd.MultiIndex.from_arrays(arrays, names = names)
+            k, h, lam, L, alpha = f['params']
+            monitor = cls(f['base'], f['phi'], keys, f['days'], year = int(f['year']),
+                          k = k, h = h, lam = lam, L = L, alpha = alpha, method = str(f['method']),
+                          ref = list(f['ref']) or None, smooth = int(f['smooth']))
+            monitor.day = int(f['day'])
+            for attr in ('cusum', 'ewma', 'observed', 'z', 'pvalue', 'onset'):
+                setattr(monitor, attr, f[attr])
+        return monitor
+
+
+def expected(cube, year = YEAR, method = 'mean', ref = None, smooth = 7):
+    """Expected daily deaths (series x day of the cube) and dispersion of all the
+    series of `cube` over the reference years, with the keys of the series.
+
+    The daily baseline is smoothed with a centred moving average over `smooth`
+    days before the expected counts are estimated.
+    """
+    values = np.asarray(cube.values, dtype=float)
+    if cube.ages is not None:
+        values = values.reshape((-1,) + values.shape[-2:])
+        keys = pd.MultiIndex.from_product([cube.codes, cube.ages],
+                                          names = [cube.codes.name or 'area', 'age'])
+    else:
+        keys = pd.Index(cube.codes, name = cube.codes.name or 'area')
+    if smooth > 1:
+        pad = smooth // 2
+        csum = np.cumsum(np.pad(values, [(0,0), (0,0), (pad, smooth-1-pad)], mode='edge'), axis=-1)
+        csum = np.concatenate([np.zeros(csum.shape[:-1] + (1,)), csum], axis=-1)
+        smoothed = (csum[..., smooth:] - csum[..., :-smooth]) / smooth
+    else:
+        smoothed = values
+    base = baseline(smoothed, cube.years, method = method, ref = ref, year = year)
+    phi = dispersion(values, cube.years, ref = ref, year = year, pooled = True)
+    return base, phi, keys
+
+
+def monitor(cube, year = YEAR, method = 'mean', ref = None, smooth = 7, **kwargs):
+    """Monitor of all the series of `cube` against the baseline of the reference
+    years, over the whole calendar; the baseline of the days not covered by
+    `cube` is left unknown until a later release covers them.
+    """
+    base, phi, keys = expected(cube, year = year, method = method, ref = ref, smooth = smooth)
+    calendar = np.full((len(keys), len(CALENDAR)), np.nan)
+    calendar[:, CALENDAR.get_indexer(cube.days)] = base
+    return Monitor(calendar, phi, keys, CALENDAR, year = year, method = method, ref = ref,
+                   smooth = smooth, **kwargs)
@@ -28,6 +28,7 @@ Metadata of IT data on morbidity.
 #%% Setttings
 
 import os, io
+import glob
 from os import path as osp
 import warnings
 
@@ -47,12 +48,14 @@ try:
 except:
     raise IOError("Impossible to handle dataframe not available: abort...")
 
-try:
-    import matplotlib.pyplot as mplt
-    import matplotlib.dates as mdates
-    from matplotlib.ticker import FuncFormatter, MaxNLocator
-except:
-    raise IOError("Impossible to draw plots: abort...")
+from ITlazy import lazy_import, is_available
+
+# plotting packages are only loaded when a figure is first drawn
+__NOPLOT = "Impossible to draw plots: abort..."
+mplt = lazy_import('matplotlib.pyplot', msg = __NOPLOT)
+mdates = lazy_import('matplotlib.dates', msg = __NOPLOT)
+FuncFormatter = lazy_import('matplotlib.ticker', attr = 'FuncFormatter', msg = __NOPLOT)
+MaxNLocator = lazy_import('matplotlib.ticker', attr = 'MaxNLocator', msg = __NOPLOT)
  
 try:                          
     import simplejson as json
@@ -67,9 +70,7 @@ except ImportError:
                 with open(arg,'r') as f:
                     return f.read()
       
-try:
-    import pyeudatnat
-except ImportError:
+if not is_available('pyeudatnat'):
     try: 
         assert __TEST_PYEUDATNAT is False
     except AssertionError:
@@ -137,9 +138,11 @@ try:
                 self.data = data
         return MortDatIT(data)
 except AssertionError:
-    from pyeudatnat.base import datnatFactory
-    from pyeudatnat.misc import Structure
-    from pyeudatnat.misc import Type, Datetime
+    # pyeudatnat (and geopandas with it) is only loaded on first use
+    datnatFactory = lazy_import('pyeudatnat.base', attr = 'datnatFactory')
+    Structure = lazy_import('pyeudatnat.misc', attr = 'Structure')
+    Type = lazy_import('pyeudatnat.misc', attr = 'Type')
+    Datetime = lazy_import('pyeudatnat.misc', attr = 'Datetime')
     def load_source(metadata):
         MorbDatIT = datnatFactory(country = "IT")
         morbdatIT = MorbDatIT(metadata)
@@ -150,6 +153,22 @@ except ImportError:
     def load_source(metadata):
         pass
 
+from ITcube import build_cube, build_age_matrix
+from ITbaseline import baseline
+from ITsignif import screen
+from ITstore import ResultStore, data_version
+from ITmapcache import ChoroplethTiles, TileCache
+from ITindex import RowIndex
+from ITzones import ZoneMap
+from ITspatial import contiguity, eb_rates
+from ITshared import publish_data
+from ITmonitor import Monitor, monitor
+from ITsimilar import excess_curves, CurveIndex
+from ITtiming import timing_levels
+from ITrates import load_population, cube_rates, matrix_rates
+from ITservice import MortalityAggregates
+from ITexplore import Explorer
+
 #%% Get metadata
 
 # METAFILEITMORT  = '../metadata/ITmetadata-original-comune_giorno.json'
@@ -322,6 +341,19 @@ try:
 except:
     pass
 
+
+#%% Results store
+# Derived tables are persisted with their parameters and the version of the input data
+
+STORE = ResultStore()
+VERSION = data_version(data)
+print('Version of the input data: %s' % VERSION)
+
+#%% Shared aggregates
+# The cleaned data and its count cubes are published as memory-mapped files that
+# other processes attach read-only with ITshared.attach, without copy
+
+SHARED = publish_data(data, osp.join(STORE.root, 'shared'), VERSION, meta = dIT.meta)
       
 #%% Space info
 # Retrieve basic temporal and geographical information
@@ -342,6 +374,13 @@ CITY = dIT.meta.get('index')['city']['name']
 comuni = data[CITY].unique()
 print('#Cities/municipalities: %s' % len(comuni))
 
+#%% Secondary indexes
+# Filters over provinces, regions, age classes, types of comuni and days are run 
+# on the index rather than scanned over the whole table
+
+INDEX = RowIndex(data, [dIT.meta.get('index')[k]['name'] for k in 
+                        ('prov_code', 'reg_code', 'age', 'city_type', 'date', 'city_code', 'city')])
+
 #%% Time info
 # Retrieve temporal series
 
@@ -531,7 +570,9 @@ def plot_one(dat, index = None, one = None, bar=False,
 years_exc = years.copy()
 years_exc.remove(YEAR)
 weeklydeaths = dailydeaths.resample('W').mean()
-avdailydeathsexc = dailydeaths[years_exc].mean(axis = 1, skipna =True) # default
+avdailydeathsexc = baseline(dailydeaths, method = 'mean', ref = years_exc) # default
+STORE.put('dailydeaths', dailydeaths, VERSION, area = 'IT', sex = 't')
+STORE.put('weeklydeaths', weeklydeaths, VERSION, area = 'IT', sex = 't')
 
 locator = mdates.DayLocator(bymonthday=[1,15]) # mdates.WeekdayLocator(interval=2)
 formatter = mdates.DateFormatter('%d/%m')
@@ -587,6 +628,7 @@ def plot_oneversus(dat, index = None, one = None, versus = None,
         return fig, pax
 
 cumdailydeaths = dailydeaths.cumsum(axis = 0, skipna =True) # default
+STORE.put('cumdailydeaths', cumdailydeaths, VERSION, area = 'IT', sex = 't')
 
 plot_oneversus(dailydeaths, one = YEAR, versus = years_exc[::-1],
             xlabel='day since Jan 1st', ylabel='death counts', 
@@ -658,9 +700,10 @@ else:
 
 for k in ageofdeaths.keys():
     deaths = ageofdeaths[k]
-    deaths['base'] = deaths[years_exc].mean(axis = 1, skipna =True) # default
+    deaths['base'] = baseline(deaths, method = 'mean', ref = years_exc) # default
     # deaths['rinc'] = deaths.apply(lambda row: (row[YEAR] - row['base']) / row['base'], axis=1)
     deaths['rinc'] = deaths[YEAR].sub(deaths.base).div(deaths.base)
+    STORE.put('ageofdeaths', deaths, VERSION, area = 'IT', sex = k, window = ddays, baseline = 'mean')
 
 astart, aend = 11, 20
 rages, sages = range(astart, aend), slice(astart, aend)
@@ -710,9 +753,10 @@ plot_one(cumdeaths/max(cumdeaths), index = sages,
 # Daily and weekly deaths in current year for Male 65+
 
 dailydeaths_m65 = pd.DataFrame()
+rows = INDEX.rows({AGE: rages})
 for y in years:
     MCOL = dIT.meta.get('index')['m_%s' % str(y)[2:]]['name'] 
-    dailydeaths_m65[y] = data[data[AGE].isin(rages)].groupby(DAY)[MCOL].agg('sum')
+    dailydeaths_m65[y] = INDEX.sum(rows, DAY, MCOL)
     if not calendar.isleap(y):
         yloc = dailydeaths_m65.columns.get_loc(y)
         dailydeaths_m65.iloc[ileapday,yloc] = dailydeaths_m65.iloc[ileapday-1,yloc]
@@ -720,6 +764,7 @@ for y in years:
 dailydeaths_m65.set_index(idx_rng, inplace=True)
 
 cumdailydeaths_m65 = dailydeaths_m65.cumsum(axis = 0, skipna =True) # default
+STORE.put('dailydeaths', dailydeaths_m65, VERSION, area = 'IT', sex = 'm', ages = rages)
 
 locator = mdates.DayLocator(bymonthday=[1,15]) # mdates.WeekdayLocator(interval=2)
 formatter = mdates.DateFormatter('%d/%m')
@@ -742,6 +787,7 @@ plot_oneversus(cumdailydeaths_m65, one = YEAR, versus = years_exc[::-1],
 
 CITY_CODE = dIT.meta.get('index')['city_code']['name']
 PROV_CODE = dIT.meta.get('index')['prov_code']['name']
+REG_CODE = dIT.meta.get('index')['reg_code']['name']
 PROVINCE = dIT.meta.get('index')['province']['name']
 
 cities = data.loc[:,[CITY, CITY_CODE, PROVINCE, PROV_CODE]].drop_duplicates()
@@ -751,24 +797,18 @@ comunitable = cities.loc[cities[CITY].isin(comuni)]
 comunitable.set_index(comunitable[CITY_CODE], inplace=True)
 # comunitable.drop(columns=CITY_CODE, inplace=True)
 
-data['refdate'] = data[DAY].apply(lambda row: get_datetime(row, YREF))
-# data.set_index('refdate', inplace=True)
-
 dstart = get_datetime('0301',YREF)
 dend = get_datetime('0321',YREF)
 
-# data[(data['refdate']>=dstart) & (data['refdate']<=dend)]
-# data[data['refdate'].between(dstart, dend, inclusive=True)]
-
 citydeaths = pd.DataFrame()
+rows = INDEX.rows({DAY: (dstart.strftime(DATEFMT), dend.strftime(DATEFMT))})
 for y in years:
     TCOL = dIT.meta.get('index')['t_%s' % str(y)[2:]]['name'] 
-    citydeaths[y] = data[data['refdate'].between(dstart, dend, inclusive=True)]   \
-        .groupby(CITY_CODE)[TCOL].agg('sum')
+    citydeaths[y] = INDEX.sum(rows, CITY_CODE, TCOL)
     # if not calendar.isleap(y) and dstart<=leapday and dend>=leapday:
     #     yloc = dailydeaths_m65.columns.get_loc(y)
     #     dailydeaths_m65.iloc[ileapday,yloc] = dailydeaths_m65.iloc[ileapday-1,yloc]
-citydeaths['base'] = citydeaths.loc[:,years_exc].max(axis=1)
+citydeaths['base'] = baseline(citydeaths, method = 'max', ref = years_exc)
 # citydeaths.drop(columns = years_exc)
 
 ax = citydeaths.plot(loglog=True,  x='base', y=YEAR, # kind='scatter',
@@ -795,6 +835,48 @@ ax.set_title('Total deaths in the period %s - %s per individual municipalities'
              (Datetime.datetime(dstart, fmt='%d %b'), Datetime.datetime(dend, fmt='%d %b')),  fontsize='medium'),
 ax.legend()
 
+#%% Figure 7 - screening
+# Municipalities with significant excess deaths over rolling weekly windows
+
+cube = build_cube(data, dIT.meta)
+signif = screen(cube, width = 7, step = 1, method = 'mean', family = 'negbin')
+print("Number of (comune, week) with significant excess (FDR 5%%): \033[1m%s\033[0m" 
+      % signif['significant'].sum())
+signif.head(10)
+
+#%% Figure 7 - online monitoring
+# CUSUM/EWMA/Farrington-like detectors per comune and province; their state is
+# persisted so that the next ingestion only processes the newly available days
+
+alerts = {}
+for level, c in (('comune', cube), ('prov', cube.aggregate(PROV_CODE))):
+    fmonitor = osp.join(STORE.root, 'monitor-%s.npz' % level)
+    mon = Monitor.load(fmonitor) if osp.exists(fmonitor) else monitor(c)
+    alerts[level] = mon.update_cube(c, end = c.last_day(YEAR))
+    mon.save(fmonitor)
+    print("Number of %s in alarm on %s: \033[1m%s\033[0m" 
+          % (level, mon.last.strftime('%d/%m'), len(alerts[level])))
+alerts['prov'].head(10)
+
+#%% Figure 7 - similar municipalities
+# Comuni whose weekly excess curve has the closest shape to that of Codogno
+
+curves = excess_curves(cube, freq = 'W')
+similar = CurveIndex(curves, mode = 'approx')
+similar.knn(data.loc[data[CITY]=='Codogno', CITY_CODE].iloc[0], k = 10)
+
+#%% Figure 7 - metropolitan cities
+# Same totals aggregated over the metropolitan cities (COD_CM) in one sparse product
+
+COD_CM = dgeoIT.meta.get('index')['COD_CM']['name']
+cmzones = ZoneMap.from_frame(dgeoIT.data, COD_CM, code = PRO_COM_T, drop = [0])
+cmcube = cmzones.aggregate(cube)
+cmdeaths = pd.DataFrame(cmcube.window(dstart, dend), index = cmcube.codes, columns = cmcube.years)
+cmdeaths['base'] = baseline(cmdeaths, method = 'mean', ref = years_exc)
+cmdeaths['rinc'] = cmdeaths[YEAR].sub(cmdeaths.base).div(cmdeaths.base)
+STORE.put('cmdeaths', cmdeaths, VERSION, sex = 't', window = (dstart, dend), baseline = 'mean')
+cmdeaths.sort_values('rinc', ascending = False).head(5)
+
 #%% Figure 7' - on map
 
 # cityrdeaths = pd.DataFrame(index=citydeaths.index)
@@ -806,6 +888,7 @@ ax.legend()
 
 citydeaths['rinc'] = citydeaths[YEAR].sub(citydeaths.base).div(citydeaths.base)
 citydeaths[PRO_COM_T] = citydeaths.index
+STORE.put('citydeaths', citydeaths, VERSION, sex = 't', window = (dstart, dend), baseline = 'max')
 geodata = geodata.merge(citydeaths, on=PRO_COM_T)
 geodata.head(5)
 
@@ -816,6 +899,68 @@ ax.set_title('Relative increment over selected cities/municipalities (comuni)',
              fontsize='small')
 mplt.show()
 
+# the same map, split into tiles rendered once per metric/window/style and then 
+# served from the cache
+maptiles = ChoroplethTiles(geodata, code = PRO_COM_T, 
+                           cache = TileCache(root = osp.join(__THISDIR, '../results/tiles')))
+print('#Rendered map tiles: %s' % 
+      maptiles.prerender(citydeaths['rinc'], zoom = 2, metric = 'rinc', window = (dstart, dend),
+                         style = {'vmin': -1, 'vmax': 3}))
+
+#%% Figure 7'' - smoothed map
+# Relative increments of tiny comuni are shrunk towards those of their neighbours
+# (local empirical Bayes over the queen contiguity of the comuni, cached on disk)
+
+cont = contiguity(dgeoIT.data, code = PRO_COM_T, kind = 'queen', 
+                  cachedir = osp.join(__THISDIR, '../results'))
+citydeaths['rinc_eb'] = eb_rates(citydeaths[YEAR], citydeaths['base'], cont) \
+    .reindex(citydeaths.index) - 1
+geodata = geodata.merge(citydeaths[[PRO_COM_T, 'rinc_eb']], on=PRO_COM_T)
+
+f, ax = mplt.subplots(1, figsize=(12, 12))
+geodata.plot(column='rinc_eb', legend=True, ax=ax)
+ax.set_axis_off()
+ax.set_title('Relative increment over selected cities/municipalities (comuni) - smoothed',  
+             fontsize='small')
+mplt.show()
+
+#%% Figure 7''' - epidemic timing
+# Onset, peak, duration and total excess of all comuni, provinces and regions at once
+
+epitiming = timing_levels(cube, levels = (None, PROV_CODE, REG_CODE), method = 'mean', sustain = 3)
+STORE.put('epitiming', epitiming, VERSION, sex = 't', baseline = 'mean', sustain = 3)
+
+onset = epitiming.loc[epitiming['level']==cube.level, 'onset']
+geodata = geodata.merge(pd.DataFrame({PRO_COM_T: onset.index, 
+                                      'onset': onset.dt.dayofyear.values}), on=PRO_COM_T, how='left')
+f, ax = mplt.subplots(1, figsize=(12, 12))
+geodata.plot(column='onset', legend=True, ax=ax, cmap='viridis', 
+             missing_kwds={'color': 'lightgrey'})
+ax.set_axis_off()
+ax.set_title('Onset (day of the year) of the excess mortality per municipality (comune)',  
+             fontsize='small')
+mplt.show()
+
+#%% Figure 7'''' - standardised rates
+# Crude and age-standardised (ESP 2013) death rates of the provinces and comuni, using the
+# resident population per comune, age and sex (ISTAT POSAS tables, stored locally
+# as ../data/population/POSAS_<year>_it_Comuni.csv)
+
+posas = sorted(glob.glob(osp.join(__THISDIR, '../data/population/POSAS_*_it_Comuni.csv')))
+if posas != []:
+    population = load_population(posas)
+    provcube = build_cube(data, dIT.meta, by = PROV_CODE, age = True)
+    provrates, provagerates = cube_rates(provcube, population, start = dstart, end = dend,
+                                         groups = cube.areas[PROV_CODE])
+    STORE.put('provrates', provrates, VERSION, sex = 't', window = (dstart, dend), standard = 'ESP2013')
+    # comuni: counts per age class kept sparse
+    cityrates, cityagerates = matrix_rates(build_age_matrix(data, dIT.meta), population, 
+                                           start = dstart, end = dend)
+    STORE.put('cityrates', cityrates, VERSION, sex = 't', window = (dstart, dend), standard = 'ESP2013')
+    provrates.xs(YEAR, level = 'year').sort_values('dsr', ascending = False).head(10)
+else:
+    print('Population data not available - standardised rates not computed')
+
 
 #%% Figures 8 - 12
 # Municipality / Codogno
@@ -828,9 +973,8 @@ provincia = cities.loc[cities[CITY]==city].loc[:,PROVINCE].values.tolist()[0]
 TCOLS = [dIT.meta.get('index')['t_%s' % str(y)[2:]]['name'] \
          for y in years]
 
-# method 1: filter first then groupby and aggregate
-dailydeaths = data[data[CITY]==city].groupby(DAY)   \
-    .agg({t:'sum' for t in TCOLS})                  
+# method 1: filter first (on the index) then groupby and aggregate
+dailydeaths = INDEX.sum(INDEX.rows({CITY: city}), DAY, TCOLS)
 dailydeaths.set_index(pd.Index(dailydeaths.index.to_series().apply(lambda ge: get_datetime(ge,YREF))), inplace=True)
 dailydeaths.sort_index(inplace=True)
 
@@ -850,6 +994,7 @@ dailydeaths = dailydeaths[dailydeaths[CITY]==city]              \
         .drop(columns=CITY)        
 dailydeaths.set_index(pd.Index(dailydeaths.index.to_series().apply(lambda ge: get_datetime(ge,YREF))), inplace=True)
 dailydeaths.sort_index(inplace=True)
+STORE.put('dailydeaths', dailydeaths, VERSION, area = city, sex = 't')
 
 
 locator = mdates.DayLocator(bymonthday=[1,15]) # mdates.WeekdayLocator(interval=2)
@@ -870,14 +1015,15 @@ plot_oneversus(cumdailydeaths, one = YEAR, versus = years_exc[::-1],
 MCOLS = [dIT.meta.get('index')['m_%s' % str(y)[2:]]['name'] \
          for y in years]
 
-# filter first then groupby and aggregate
-dailydeaths_m65 = data[(data[CITY]==city) & (data[AGE].isin(rages))].groupby(DAY)   \
-    .agg({t:'sum' for t in MCOLS})                  
+# filter first (on the index) then groupby and aggregate
+dailydeaths_m65 = INDEX.sum(INDEX.rows({CITY: city, AGE: rages}), DAY, MCOLS)
 dailydeaths_m65.set_index(pd.Index(dailydeaths_m65.index.to_series().apply(lambda ge: get_datetime(ge,YREF))), inplace=True)
 dailydeaths_m65.sort_index(inplace=True)
 dailydeaths_m65 = dailydeaths_m65.reindex(idx_timeline)      \
     .rename(columns={t:int('20%s' %t[-2:])  for t in MCOLS})    \
 
+STORE.put('dailydeaths', dailydeaths_m65, VERSION, area = city, sex = 'm', ages = rages)
+
 # dailydeaths_m65 = pd.DataFrame()
 # for y in years:
 #     MCOL = dIT.meta.get('index')['m_%s' % str(y)[2:]]['name'] 
@@ -912,11 +1058,12 @@ print("Number of provinces represented in the dataset: \033[1m%s\033[0m" % len(p
 provinces.head(10)
 
 provdeaths = pd.DataFrame()
+rows = INDEX.rows({DAY: (dstart.strftime(DATEFMT), dend.strftime(DATEFMT))})
 for y in years:
     TCOL = dIT.meta.get('index')['t_%s' % str(y)[2:]]['name'] 
-    provdeaths[y] = data[data['GE_DATE'].between(dstart, dend, inclusive=True)]   \
-        .groupby(PROV_CODE)[TCOL].agg('sum')
-provdeaths['base'] = provdeaths.loc[:,years_exc].mean(axis=1)
+    provdeaths[y] = INDEX.sum(rows, PROV_CODE, TCOL)
+provdeaths['base'] = baseline(provdeaths, method = 'mean', ref = years_exc)
+STORE.put('provdeaths', provdeaths, VERSION, sex = 't', window = (dstart, dend), baseline = 'mean')
 assert len(provinces) == len(provdeaths)
 
 provdeaths.drop(provdeaths[provdeaths[YEAR]<10].index, inplace=True)
@@ -965,14 +1112,16 @@ print("Analysing the 'provincia di' \033[1m%s\033[0m (#\033[1m%s\033[0m)"
       % (provincia,int(provincia_code)))
 
 dailydeaths = pd.DataFrame()
+rows = INDEX.rows({PROV_CODE: provincia_code})
 for y in years:
     TCOL = dIT.meta.get('index')['t_%s' % str(y)[2:]]['name'] 
-    dailydeaths[y] = data[data[PROV_CODE]==provincia_code].groupby(DAY)[TCOL].agg('sum')
+    dailydeaths[y] = INDEX.sum(rows, DAY, TCOL)
     if not calendar.isleap(y):
         yloc = dailydeaths.columns.get_loc(y)
         dailydeaths.iloc[ileapday,yloc] = dailydeaths.iloc[ileapday-1,yloc]
 dailydeaths.set_index(dailydeaths.index.to_series().apply(lambda ge: get_datetime(ge,YREF)), inplace=True)
 dailydeaths = dailydeaths.reindex(idx_timeline, fill_value=0)       
+STORE.put('dailydeaths', dailydeaths, VERSION, area = provincia, sex = 't')
 
 cumdailydeaths = dailydeaths.cumsum(axis = 0)
 
@@ -991,14 +1140,16 @@ plot_oneversus(cumdailydeaths, one = YEAR, versus = years_exc[::-1], fig = fig,
               )
 
 dailydeaths_m65 = pd.DataFrame()
+rows = INDEX.rows({PROV_CODE: provincia_code, AGE: rages})
 for y in years:
     MCOL = dIT.meta.get('index')['m_%s' % str(y)[2:]]['name'] 
-    dailydeaths_m65[y] = data[(data[PROV_CODE]==provincia_code) & (data[AGE].isin(rages))].groupby(DAY)[MCOL].agg('sum')
+    dailydeaths_m65[y] = INDEX.sum(rows, DAY, MCOL)
     if not calendar.isleap(y):
         yloc = dailydeaths_m65.columns.get_loc(y)
         dailydeaths_m65.iloc[ileapday,yloc] = dailydeaths_m65.iloc[ileapday-1,yloc]
 dailydeaths_m65.set_index(dailydeaths_m65.index.to_series().apply(lambda ge: get_datetime(ge,YREF)), inplace=True)
 dailydeaths_m65 = dailydeaths_m65.reindex(idx_timeline, fill_value=0) 
+STORE.put('dailydeaths', dailydeaths_m65, VERSION, area = provincia, sex = 'm', ages = rages)
 
 cumdailydeaths_m65 = dailydeaths_m65.cumsum(axis = 0, skipna =True) # default
 
@@ -1014,3 +1165,12 @@ plot_oneversus(cumdailydeaths_m65, one = YEAR, versus = years_exc[::-1], fig = f
                % (fign[provincia],provincia),
             locator = locator, formatter = formatter)
 
+
+#%% Interactive exploration
+# Area/age/sex/window selectors answered from the pre-aggregated counts (notebooks only)
+
+try:
+    explorer = Explorer(MortalityAggregates(data, dIT.meta))
+    explorer.widgets(level = 'prov')
+except IOError:
+    print('Widgets not available - interactive exploration skipped')
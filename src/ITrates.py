@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+.. _ITrates
+
+Mortality rates of IT data: crude, age-specific and age-standardised.
+
+Death counts only compare areas of similar size and age structure. The
+resident population (ISTAT *POSAS* tables, one local file per year: population
+on the 1st of January per comune, single year of age and sex) is therefore
+aggregated to the age classes ``CL_ETA`` of the mortality data and arranged
+as an array ``(area, age, year)`` parallel to the death counts. Crude,
+age-specific and directly standardised rates (European Standard Population
+2013 by default) of all areas and years are then computed in a single call.
+
+**Dependencies**
+
+*require*:      :mod:`numpy`, :mod:`pandas`
+
+**Contents**
+"""
+
+# *since*:        Mon Oct 19 12:30:03 2026
+
+#%% Settings
+
+import re
+import warnings
+from statistics import NormalDist
+
+try:
+    import numpy as np
+    import pandas as pd
+except:
+    raise IOError("Impossible to handle dataframe not available: abort...")
+
+from ITcube import SEXES, day_timestamp
+
+# columns of the POSAS tables, e.g. POSAS_2020_it_Comuni.csv
+POSAS = {'city_code':   'Codice comune',
+         'age':         'Età',
+         'm':           'Totale Maschi',
+         'f':           'Totale Femmine',
+         'total':       999,            # age of the rows holding the total over ages
+         'sep':         ';',
+         'skiprows':    1               # title line
+         }
+
+# European Standard Population 2013 by 5-year age groups, the last one (95+)
+# pooling the classes 95-99 and 100+ of CL_ETA
+ESP2013 = pd.Series([1000, 4000, 5500, 5500, 5500, 6000, 6000, 6500, 7000, 7000, 7000,
+                     7000, 6500, 6000, 5500, 5000, 4000, 2500, 1500, 800, 200],
+                    index = range(21), name = 'ESP2013')
+
+
+#%% Population
+
+def age_class(age):
+    """CL_ETA class of single years of age: 0, 1-4, 5-9, ..., 95-99, 100+."""
+    age = np.asarray(age, dtype=int)
+    return np.where(age == 0, 0, np.minimum(np.where(age < 5, 1, age // 5 + 1), 21))
+
+
+def read_posas(source, year = None, columns = POSAS, **kwargs):
+    """Read a POSAS table into a long dataframe with columns ``city_code``
+    (6-digit code as ``COD_PROVCOM``), ``year``, ``age`` (CL_ETA class),
+    ``sex`` and ``population``.
+
+    When `year` is not given, it is read from the name of the file.
+    """
+    if year is None:
+        match = re.search(r'(19|20)\d{2}', str(source))
+        if match is None:
+            raise IOError("Year of the population of %s not recognised" % source)
+        year = int(match.group(0))
+    kwargs = dict(dict(sep = columns['sep'], skiprows = columns['skiprows']), **kwargs)
+    try:
+        pop = pd.read_csv(source, dtype = {columns['city_code']: str}, **kwargs)
+    except:
+        raise IOError("Impossible to read population data %s" % source)
+    pop = pop[pd.to_numeric(pop[columns['age']], errors='coerce') != columns['total']]
+    pop = pop.dropna(subset = [columns['age']])
+    frames = [pd.DataFrame({'city_code':    pop[columns['city_code']].str.strip().str.zfill(6).values,
+                            'year':         year,
+                            'age':          age_class(pop[columns['age']].astype(int)),
+                            'sex':          sex,
+                            'population':   pd.to_numeric(pop[columns[sex]], errors='coerce').fillna(0).values})
+              for sex in ('m', 'f')]
+    return pd.concat(frames).groupby(['city_code', 'year', 'age', 'sex'], as_index = False)['population'].sum()
+
+
+def load_population(sources, **kwargs):
+    """Concatenate the POSAS tables given as a list of files or as a dictionary
+    ``{year: file}``.
+    """
+    if isinstance(sources, dict):
+        return pd.concat([read_posas(src, year = y, **kwargs) for y, src in sources.items()],
+                         ignore_index = True)
+    return pd.concat([read_posas(src, **kwargs) for src in sources], ignore_index = True)
+
+
+def build_population(pop, codes, ages, years, sex = 't', groups = None, dtype = float):
+    """Arrange the population into an array ``(area, age, year)`` aligned on the
+    area codes, age classes and years of the death counts.
+
+    Comuni are summed into areas when `groups` (series mapping the comuni codes
+    onto the codes of the areas, e.g. ``cube.areas[PROV]``) is passed. Years
+    not available in the population are filled with the closest available year.
+    """
+    if sex not in SEXES:
+        raise IOError("Sex '%s' not recognised - must be one of %s" % (sex, SEXES))
+    if sex != 't':
+        pop = pop[pop['sex'] == sex]
+    areas = pop['city_code']
+    if groups is not None:
+        groups = pd.Series(groups)
+        groups.index = groups.index.astype(str)
+        areas = areas.map(groups)
+    codes, ages = pd.Index(codes), list(ages)
+    avail = sorted(pop['year'].unique())
+    if avail == []:
+        raise IOError("No population data available")
+    closest = {y: min(avail, key = lambda a: (abs(a - y), -a)) for y in years}
+    if any(closest[y] != y for y in years):
+        warnings.warn("Population not available for years %s - closest years used"
+                      % [y for y in years if closest[y] != y])
+    ia = codes.get_indexer(pd.Index(areas.values))
+    ik = pd.Index(ages).get_indexer(pop['age'].values)
+    keep = (ia >= 0) & (ik >= 0)
+    values = np.zeros((len(codes), len(ages), len(years)), dtype = dtype)
+    for iy, y in enumerate(years):
+        sel = keep & (pop['year'].values == closest[y])
+        flat = ia[sel] * len(ages) + ik[sel]
+        values[:, :, iy] = np.bincount(flat, weights = pop['population'].values[sel],
+                                       minlength = len(codes) * len(ages)).reshape(len(codes), len(ages))
+    return values
+
+
+#%% Rates
+
+def _day_slice(days, start, end):
+    return days.slice_indexer(day_timestamp(start), day_timestamp(end))
+
+def window_counts(matrix, ages, years, days, start = None, end = None):
+    """Death counts ``(area, age, year)`` over the days from `start` to `end`
+    of the sparse matrix returned by :func:`ITcube.build_age_matrix`.
+    """
+    inday = np.zeros(len(days), dtype=bool)
+    inday[_day_slice(days, start, end)] = True
+    # (year, day) columns summed per year with a sparse indicator product
+    indicator = np.kron(np.eye(len(years)), inday[:, None].astype(float))
+    counts = np.asarray(matrix @ indicator)
+    return counts.reshape(-1, len(ages), len(years))
+
+
+def standardized_rates(deaths, population, ages, standard = ESP2013, per = 1e5, period = 1., level = 0.95):
+    """Crude, age-specific and directly standardised rates of all areas and years.
+
+    `deaths` and `population` are arrays ``(area, age, year)``; `period` is the
+    length (in years) of the period of the deaths. Age classes are matched onto
+    the groups of the `standard` population, those not in the standard (CL_ETA
+    100+ for the ESP) being pooled with the last group. Returns a dictionary
+    of arrays: ``crude`` and ``dsr`` ``(area, year)`` with the standard error
+    ``se`` and the normal bounds ``lower``/``upper`` of the latter, and
+    ``specific`` ``(area, age, year)``.
+    """
+    d = np.asarray(deaths, dtype=float)
+    p = np.asarray(population, dtype=float) * period
+    if d.shape != p.shape:
+        raise IOError("Deaths of shape %s and population of shape %s do not match" % (d.shape, p.shape))
+    groups = pd.Index(standard.index)
+    igroup = np.minimum(groups.searchsorted(ages, side='right') - 1, len(groups) - 1)
+    member = np.zeros((len(ages), len(groups)))
+    member[np.arange(len(ages)), igroup] = 1
+    w = standard.values / standard.values.sum()
+    dg, pg = np.einsum('aky,kg->agy', d, member), np.einsum('aky,kg->agy', p, member)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crude = d.sum(axis=1) / p.sum(axis=1)
+        specific = np.where(p > 0, d / p, np.nan)
+        # groups without population contribute no death to the standardised rate
+        rg = np.where(pg > 0, dg / pg, 0)
+        dsr = np.einsum('g,agy->ay', w, rg)
+        se = np.sqrt(np.einsum('g,agy->ay', w**2, np.where(pg > 0, dg / pg**2, 0)))
+        dsr = np.where(p.sum(axis=1) > 0, dsr, np.nan)
+    z = NormalDist().inv_cdf(1 - (1 - level) / 2)
+    return {'crude':    crude * per,
+            'specific': specific * per,
+            'dsr':      dsr * per,
+            'se':       se * per,
+            'lower':    np.clip(dsr - z * se, 0, None) * per,
+            'upper':    (dsr + z * se) * per}
+
+
+def rates_frame(rates, codes, ages, years):
+    """Tables of the rates: one indexed by (area, year), one by (area, age, year)
+    for the age-specific rates.
+    """
+    codes = pd.Index(codes)
+    index = pd.MultiIndex.from_product([codes, years], names = [codes.name or 'area', 'year'])
+    table = pd.DataFrame({k: rates[k].ravel() for k in ('crude', 'dsr', 'se', 'lower', 'upper')},
+                         index = index)
+    index = pd.MultiIndex.from_product([codes, ages, years], names = [codes.name or 'area', 'age', 'year'])
+    return table, pd.DataFrame({'rate': rates['specific'].ravel()}, index = index)
+
+
+def cube_rates(cube, pop, start = None, end = None, groups = None, standard = ESP2013,
+               per = 1e5, annualize = True, **kwargs):
+    """Rates of all the areas of a :class:`ITcube.DeathCube` with ages over the
+    days from `start` to `end`; see :func:`standardized_rates`.
+
+    When `annualize` is set, rates are expressed per `per` person-years.
+    """
+    if cube.ages is None:
+        raise IOError("Cube of counts per age class needed for standardised rates")
+    sl = cube.day_slice(start, end)
+    deaths = cube.values[..., sl].sum(axis=-1)
+    population = build_population(pop, cube.codes, cube.ages, cube.years, sex = cube.sex, groups = groups)
+    period = len(cube.days[sl]) / 365.25 if annualize is True else 1.
+    rates = standardized_rates(deaths, population, cube.ages, standard = standard, per = per,
+                               period = period, **kwargs)
+    return rates_frame(rates, cube.codes, cube.ages, cube.years)
+
+
+def matrix_rates(agematrix, pop, start = None, end = None, sex = 't', standard = ESP2013,
+                 per = 1e5, annualize = True, **kwargs):
+    """Rates of all the comuni over the days from `start` to `end`, from the
+    sparse counts ``(matrix, codes, ages, years, days)`` returned by
+    :func:`ITcube.build_age_matrix`, so that no dense cube of the comuni per
+    age class is ever built; see :func:`cube_rates`.
+    """
+    matrix, codes, ages, years, days = agematrix
+    deaths = window_counts(matrix, ages, years, days, start = start, end = end)
+    population = build_population(pop, codes, ages, years, sex = sex)
+    period = len(days[_day_slice(days, start, end)]) / 365.25 if annualize is True else 1.
+    rates = standardized_rates(deaths, population, ages, standard = standard, per = per,
+                               period = period, **kwargs)
+    return rates_frame(rates, codes, ages, years)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+.. _ITshared
+
+Zero-copy sharing of the cleaned IT mortality data and of its aggregates.
+
+The cleaned table (the output of ``dIT.data``) and the count cubes derived
+from it are published once in a directory, as memory-mapped :mod:`numpy`
+arrays (``.npy``) and Arrow IPC files, described by a small JSON manifest.
+Any process (notebook kernel, report worker, web service) can then attach them
+read-only: pages are shared through the OS page cache instead of being copied
+or unpickled in every process.
+
+Publications are versioned: every version is written into its own directory,
+then made current atomically::
+
+    <root>/CURRENT
+    <root>/<version>/manifest.json
+    <root>/<version>/*.npy, *.arrow
+
+**Dependencies**
+
+*require*:      :mod:`numpy`, :mod:`pandas`
+
+*optional*:     :mod:`pyarrow` (tables are otherwise stored column-wise as ``.npy``)
+
+**Contents**
+"""
+
+# *since*:        Mon Oct 19 12:25:30 2026
+
+#%% Settings
+
+import os
+from os import path as osp
+import shutil
+import tempfile
+
+from datetime import datetime
+
+try:
+    import numpy as np
+    import pandas as pd
+except:
+    raise IOError("Impossible to handle dataframe not available: abort...")
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from ITlazy import lazy_import, is_available
+from ITcube import SEXES, DeathCube, build_cube, load_meta
+
+pa = lazy_import('pyarrow', msg = "Package pyarrow not available: abort...")
+
+MANIFEST = 'manifest.json'
+CURRENT = 'CURRENT'
+
+
+#%% Writers
+
+def _write_array(dirname, name, array):
+    fname = '%s.npy' % name
+    np.save(osp.join(dirname, fname), np.ascontiguousarray(array), allow_pickle = False)
+    return {'kind': 'array', 'file': fname, 'dtype': str(array.dtype), 'shape': list(array.shape)}
+
+def _write_table(dirname, name, frame, arrow = None):
+    index = [n for n in frame.index.names if n is not None]
+    frame = frame.reset_index() if index != [] else frame.reset_index(drop = True)
+    frame.columns = [str(c) for c in frame.columns]
+    if arrow is None:
+        arrow = is_available('pyarrow')
+    if arrow is True:
+        fname = '%s.arrow' % name
+        table = pa.Table.from_pandas(frame, preserve_index = False)
+        with pa.OSFile(osp.join(dirname, fname), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        return {'kind': 'table', 'format': 'arrow', 'file': fname, 'index': index,
+                'nrows': len(frame)}
+    # column-wise arrays; strings are stored as fixed-width unicode so that no
+    # pickling is ever needed
+    files = {}
+    for i, col in enumerate(frame.columns):
+        values = frame[col].to_numpy()
+        if values.dtype == object or pd.api.types.is_string_dtype(frame[col].dtype):
+            values = frame[col].astype(str).to_numpy(dtype = str)
+        files[col] = '%s.%s.npy' % (name, i)
+        np.save(osp.join(dirname, files[col]), values, allow_pickle = False)
+    return {'kind': 'table', 'format': 'npy', 'files': files, 'columns': list(frame.columns),
+            'index': index, 'nrows': len(frame)}
+
+
+def publish(root, version, arrays = None, tables = None, cubes = None, arrow = None):
+    """Publish arrays, tables and cubes (dictionaries keyed by name) under `root`
+    as a new `version`, made current once completely written.
+
+    Versions are digests of their content, so a version already published is
+    never rewritten (readers may still be attaching its files): it is only
+    made current again.
+    """
+    os.makedirs(root, exist_ok = True)
+    target = osp.join(root, version)
+    if osp.exists(osp.join(target, MANIFEST)):
+        _set_current(root, version)
+        return target
+    tmpdir = tempfile.mkdtemp(prefix = '.%s-' % version, dir = root)
+    manifest = {'version': version, 'created': datetime.now().isoformat(), 'items': {}}
+    items = manifest['items']
+    try:
+        for name, array in (arrays or {}).items():
+            items[name] = _write_array(tmpdir, name, array)
+        for name, frame in (tables or {}).items():
+            items[name] = _write_table(tmpdir, name, frame, arrow = arrow)
+        for name, cube in (cubes or {}).items():
+            items[name] = {'kind':      'cube',
+                           'values':    _write_array(tmpdir, '%s.values' % name, cube.values),
+                           'missing':   None if cube.missing is None else
+                                            _write_array(tmpdir, '%s.missing' % name, cube.missing),
+                           'areas':     _write_table(tmpdir, '%s.areas' % name, cube.areas, arrow = arrow),
+                           'years':     [int(y) for y in cube.years],
+                           'days':      [cube.days[0].isoformat(), len(cube.days)],
+                           'ages':      None if cube.ages is None else [int(a) for a in cube.ages],
+                           'sex':       cube.sex,
+                           'level':     cube.level}
+        with open(osp.join(tmpdir, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent = 1)
+        if osp.exists(target):
+            # leftover of an interrupted publication: no manifest, hence no reader
+            shutil.rmtree(target)
+        os.replace(tmpdir, target)
+    except:
+        shutil.rmtree(tmpdir, ignore_errors = True)
+        raise
+    _set_current(root, version)
+    return target
+
+
+def _set_current(root, version):
+    tmp = osp.join(root, '%s.%s.tmp' % (CURRENT, os.getpid()))
+    with open(tmp, 'w') as f:
+        f.write(version)
+    os.replace(tmp, osp.join(root, CURRENT))
+
+
+def publish_data(data, root, version, meta = None, sexes = SEXES, table = True, arrow = None, **kwargs):
+    """Publish the cleaned table (unless `table` is False) and its count cubes per
+    sex under `root` as `version`; `arrow` is passed to :func:`publish` and other
+    keyword arguments to :func:`ITcube.build_cube`.
+    """
+    if osp.exists(osp.join(root, version, MANIFEST)):
+        # already published: the cubes need not be rebuilt
+        _set_current(root, version)
+        return osp.join(root, version)
+    meta = meta or load_meta()
+    cubes = {'cube_%s' % sex: build_cube(data, meta, sex = sex, **kwargs) for sex in sexes}
+    tables = {'data': data} if table is True else {}
+    return publish(root, version, tables = tables, cubes = cubes, arrow = arrow)
+
+
+#%% Readers
+
+class SharedData(object):
+    """Read-only view of a published version; items are attached on first access.
+    """
+
+    def __init__(self, root, version = None):
+        if version is None:
+            with open(osp.join(root, CURRENT), 'r') as f:
+                version = f.read().strip()
+        self.root, self.version = root, version
+        self.dirname = osp.join(root, version)
+        with open(osp.join(self.dirname, MANIFEST), 'r') as f:
+            self.manifest = json.load(f)
+        self._attached = {}
+
+    def __contains__(self, name):
+        return name in self.manifest['items']
+
+    @property
+    def names(self):
+        return list(self.manifest['items'].keys())
+
+    def _array(self, item):
+        # memory-mapped: no data is read until the pages are accessed
+        return np.load(osp.join(self.dirname, item['file']), mmap_mode = 'r', allow_pickle = False)
+
+    def _arrow(self, item):
+        source = pa.memory_map(osp.join(self.dirname, item['file']), 'r')
+        return pa.ipc.open_file(source).read_all()
+
+    def _frame(self, item):
+        if item['format'] == 'arrow':
+            # one block per column: numeric columns without nulls are then
+            # views on the memory-mapped buffers, not copies
+            frame = self._arrow(item).to_pandas(split_blocks = True, self_destruct = False)
+        else:
+            frame = pd.DataFrame({c: np.load(osp.join(self.dirname, f), mmap_mode = 'r')
+                                  for c, f in item['files'].items()}, copy = False)
+        return frame.set_index(item['index']) if item['index'] != [] else frame
+
+    def array(self, name):
+        return self._attach(name, 'array', self._array)
+
+    def arrow(self, name):
+        """Arrow table, backed by the memory-mapped file (zero-copy)."""
+        if self.manifest['items'].get(name, {}).get('format', 'arrow') != 'arrow':
+            raise IOError("Table '%s' not published in Arrow format in version %s" % (name, self.version))
+        return self._attach(name, 'table', self._arrow)
+
+    def frame(self, name):
+        """Dataframe of a table; numeric columns are not copied when possible."""
+        return self._attach(name, 'table', self._frame)
+
+    def cube(self, name):
+        def _cube(item):
+            start, ndays = item['days']
+            return DeathCube(self._array(item['values']), self._frame(item['areas']), item['years'],
+                             pd.date_range(start = start, periods = ndays, freq = 'D'),
+                             ages = item['ages'], sex = item['sex'],
+                             missing = None if item['missing'] is None else self._array(item['missing']),
+                             level = item['level'])
+        return self._attach(name, 'cube', _cube)
+
+    def _attach(self, name, kind, func):
+        try:
+            item = self.manifest['items'][name]
+        except KeyError:
+            raise IOError("Item '%s' not published in version %s" % (name, self.version))
+        if item['kind'] != kind:
+            raise IOError("Item '%s' is a %s, not a %s" % (name, item['kind'], kind))
+        key = (name, func.__name__)
+        if key not in self._attached:
+            self._attached[key] = func(item)
+        return self._attached[key]
+
+
+def attach(root, version = None):
+    return SharedData(root, version = version)
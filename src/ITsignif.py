@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+.. _ITsignif
+
+Statistical screening of excess mortality over all areas and date windows.
+
+Deaths of the current year are tested against the baseline of every area of a
+:class:`ITcube.DeathCube` and every (rolling) window of days at once, under a
+Poisson or negative-binomial model. Multiple testing is controlled with the
+Benjamini-Hochberg false discovery rate procedure.
+
+**Dependencies**
+
+*require*:      :mod:`numpy`, :mod:`pandas`
+
+*optional*:     :mod:`scipy`
+
+**Contents**
+"""
+
+# *since*:        Mon Oct 19 11:26:05 2026
+
+#%% Settings
+
+from statistics import NormalDist
+
+try:
+    import numpy as np
+    import pandas as pd
+except:
+    raise IOError("Impossible to handle dataframe not available: abort...")
+
+from ITlazy import lazy_import, is_available
+from ITcube import YEAR
+from ITbaseline import baseline, dispersion, excess
+
+sstats = lazy_import('scipy.stats') if is_available('scipy') else None
+
+FAMILIES = ('poisson', 'negbin')
+
+
+#%% Windows
+
+def rolling_windows(values, width = 7, step = 1, dtype = None):
+    """Sums over rolling windows of `width` days taken every `step` days.
+
+    Returns the sums, with the day axis (last one) replaced by the windows,
+    together with the position of the first day of every window. Sums are
+    accumulated as `dtype`, by default integers for counts and floats otherwise.
+    """
+    values = np.asarray(values)
+    if dtype is None:
+        dtype = np.int64 if np.issubdtype(values.dtype, np.integer) else np.float64
+    nday = values.shape[-1]
+    if width > nday:
+        raise IOError("Window of %s days larger than the series (%s days)" % (width, nday))
+    csum = np.concatenate([np.zeros(values.shape[:-1] + (1,), dtype=dtype),
+                           np.cumsum(values, axis=-1, dtype=dtype)], axis=-1)
+    starts = np.arange(0, nday - width + 1, step)
+    return csum[..., starts + width] - csum[..., starts], starts
+
+
+#%% Tests
+
+def upper_pvalue(observed, expected, family = 'poisson', phi = None):
+    """One-sided p-value P(X >= observed) of the counts given the expected ones.
+
+    Counts with no expected deaths cannot be tested: their p-value is nan.
+    """
+    observed = np.asarray(observed, dtype=float)
+    expected = np.asarray(expected, dtype=float)
+    if family not in FAMILIES:
+        raise IOError("Family '%s' not recognised - must be one of %s" % (family, FAMILIES))
+    if family == 'negbin' and phi is None:
+        raise IOError("Dispersion needs to be passed with the negative binomial family")
+    phi = 1. if family == 'poisson' else np.broadcast_to(np.asarray(phi, dtype=float), expected.shape)
+    if sstats is None:
+        # normal approximation with continuity correction
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = (observed - 0.5 - expected) / np.sqrt(expected * phi)
+        return np.where(expected > 0, 1 - np.vectorize(NormalDist().cdf)(z), np.nan)
+    if family == 'poisson':
+        return np.where(expected > 0, sstats.poisson.sf(observed - 1, expected), np.nan)
+    # negative binomial with mean mu and variance phi*mu: n = mu/(phi-1), p = 1/phi;
+    # series with no overdispersion fall back on Poisson
+    pois = sstats.poisson.sf(observed - 1, expected)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n = expected / (phi - 1)
+        nb = sstats.nbinom.sf(observed - 1, n, 1. / phi)
+    return np.where(expected > 0, np.where(phi > 1, nb, pois), np.nan)
+
+
+def fdr(pvalues):
+    """Benjamini-Hochberg adjusted p-values (q-values) of a flat array of p-values.
+    """
+    p = np.asarray(pvalues, dtype=float).ravel()
+    m = np.isfinite(p).sum()
+    order = np.argsort(p, kind='stable')   # nan last
+    q = p[order] * m / np.arange(1, len(p) + 1)
+    q = np.fmin.accumulate(q[::-1])[::-1]
+    out = np.empty_like(p)
+    out[order] = np.clip(q, 0, 1)
+    return out.reshape(np.shape(pvalues))
+
+
+def screen(cube, width = 7, step = 1, year = YEAR, method = 'mean', family = 'poisson',
+           alpha = 0.05, ref = None, sort = True, **kwargs):
+    """Test the deaths of `year` against the baseline in all areas and windows.
+
+    Returns a dataframe indexed by (area, window start) with the observed and
+    expected counts, excess, relative increment, z-score, p-value and FDR
+    q-value, sorted by increasing p-value (and decreasing z-score).
+    """
+    if cube.ages is not None:
+        cube = cube.collapse_ages()
+    wsum, starts = rolling_windows(cube.values, width = width, step = step)
+    observed = wsum[:, cube.year_index(year)].astype(float)
+    expected = baseline(wsum, cube.years, method = method, ref = ref, year = year, **kwargs)
+    # one dispersion per area, pooled over all its windows: 5 reference values
+    # per window would give very unstable estimates
+    phi = dispersion(wsum, cube.years, ref = ref, year = year, pooled = True) \
+        if family == 'negbin' else 1.
+    pvalue = upper_pvalue(observed, expected, family = family, phi = phi)
+    if cube.missing is not None:
+        # counts not available (n.d.) in `year` are not tested
+        pvalue[np.asarray(cube.missing)[:, cube.year_index(year)]] = np.nan
+    qvalue = fdr(pvalue)
+    exc, rinc = excess(observed, expected)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(expected > 0, exc / np.sqrt(expected * phi), np.nan)
+
+    narea, nwin = observed.shape
+    index = pd.MultiIndex.from_arrays([np.repeat(cube.codes.values, nwin),
+                                       np.tile(cube.days[starts], narea)],
+                                      names = [cube.codes.name or 'area', 'start'])
+    table = pd.DataFrame({'end':        np.tile(cube.days[starts + width - 1], narea),
+                          'observed':   observed.ravel(),
+                          'expected':   expected.ravel(),
+                          'excess':     exc.ravel(),
+                          'rinc':       rinc.ravel(),
+                          'z':          z.ravel(),
+                          'pvalue':     pvalue.ravel(),
+                          'qvalue':     qvalue.ravel(),
+                          }, index = index)
+    table['significant'] = table['qvalue'] <= alpha
+    if sort is True:
+        table.sort_values(['pvalue', 'z'], ascending = [True, False], inplace = True)
+    return table
+
+
+def screen_levels(cube, levels = (None,), **kwargs):
+    """Run :func:`screen` on the cube and its aggregates, e.g. ``(None, 'PROV', 'REG')``.
+
+    The FDR is controlled within every level separately.
+    """
+    tables = []
+    for level in levels:
+        c = cube if level is None else cube.aggregate(level)
+        t = screen(c, **kwargs)
+        t.insert(0, 'level', c.level)
+        t.index = t.index.set_names(['area', 'start'])
+        tables.append(t)
+    return pd.concat(tables)
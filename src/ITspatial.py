@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+.. _ITspatial
+
+Spatial smoothing of small-area excess mortality over the comuni adjacency graph.
+
+The contiguity (queen or rook) of the comuni polygons, e.g. those of
+``Com01012020_WGS84.shp``, is built once with a bulk spatial index query
+(instead of testing all pairs of polygons) and cached on disk as a sparse
+matrix. Neighbourhood-pooled and empirical Bayes rates are then computed for
+all comuni at once with sparse matrix products.
+
+**Dependencies**
+
+*require*:      :mod:`numpy`, :mod:`pandas`, :mod:`scipy`
+
+*optional*:     :mod:`geopandas`, :mod:`shapely` (building the contiguity)
+
+**Contents**
+"""
+
+# *since*:        Mon Oct 19 12:24:02 2026
+
+#%% Settings
+
+import os
+from os import path as osp
+import hashlib
+
+try:
+    import numpy as np
+    import pandas as pd
+except:
+    raise IOError("Impossible to handle dataframe not available: abort...")
+
+from ITlazy import lazy_import
+
+sparse = lazy_import('scipy.sparse', msg = "Package scipy not available: smoothing not supported")
+shapely = lazy_import('shapely', msg = "Package shapely not available: contiguity not supported")
+
+KINDS = ('queen', 'rook')
+
+
+#%% Contiguity
+
+class Contiguity(object):
+    """Symmetric binary adjacency matrix of the comuni, with their codes.
+    """
+
+    def __init__(self, matrix, codes, kind = 'queen'):
+        self.matrix = sparse.csr_matrix(matrix)
+        self.codes = pd.Index(codes)
+        self.kind = kind
+
+    @property
+    def cardinalities(self):
+        return pd.Series(np.diff(self.matrix.indptr), index = self.codes, name = 'neighbours')
+
+    @property
+    def islands(self):
+        return self.codes[np.diff(self.matrix.indptr) == 0]
+
+    def neighbours(self, code):
+        i = self.codes.get_loc(code)
+        return self.codes[self.matrix.indices[self.matrix.indptr[i]:self.matrix.indptr[i+1]]]
+
+    def save(self, fname):
+        np.savez_compressed(fname, indptr = self.matrix.indptr, indices = self.matrix.indices,
+                            shape = self.matrix.shape, codes = np.asarray(self.codes, dtype=str),
+                            kind = self.kind)
+
+    @classmethod
+    def load(cls, fname):
+        with np.load(fname) as f:
+            n = int(f['shape'][0])
+            matrix = sparse.csr_matrix((np.ones(len(f['indices']), dtype=np.int8), f['indices'], f['indptr']),
+                                       shape = (n, n))
+            return cls(matrix, f['codes'], kind = str(f['kind']))
+
+
+def geodigest(geodata, code = 'PRO_COM_T'):
+    # digest of the codes and bounds of the geometries, identifying the cached contiguity
+    h = hashlib.sha1(np.asarray(geodata[code], dtype=str).tobytes())
+    h.update(np.round(geodata.geometry.bounds.values, 6).tobytes())
+    return h.hexdigest()[:16]
+
+
+def build_contiguity(geodata, code = 'PRO_COM_T', kind = 'queen', tolerance = 0):
+    """Build the contiguity of the polygons of `geodata`.
+
+    Candidate pairs are retrieved at once from the spatial index (STR tree) of
+    the geometries; only those intersecting are kept (queen). For the rook
+    contiguity, pairs must moreover share a boundary of length > `tolerance`.
+    """
+    if kind not in KINDS:
+        raise IOError("Contiguity '%s' not recognised - must be one of %s" % (kind, KINDS))
+    geoms = geodata.geometry.values
+    if tolerance > 0:
+        # tolerate small gaps/slivers between neighbouring polygons
+        left, right = geodata.sindex.query(shapely.buffer(np.asarray(geoms), tolerance),
+                                           predicate = 'intersects')
+    else:
+        left, right = geodata.sindex.query(geoms, predicate = 'intersects')
+    keep = left < right
+    left, right = left[keep], right[keep]
+    if kind == 'rook':
+        shared = shapely.intersection(shapely.boundary(np.asarray(geoms)[left]),
+                                      shapely.boundary(np.asarray(geoms)[right]))
+        keep = shapely.length(shared) > tolerance
+        left, right = left[keep], right[keep]
+    n = len(geoms)
+    matrix = sparse.coo_matrix((np.ones(2*len(left), dtype=np.int8),
+                                (np.r_[left, right], np.r_[right, left])), shape = (n, n)).tocsr()
+    matrix.data[:] = 1
+    return Contiguity(matrix, np.asarray(geodata[code], dtype=str), kind = kind)
+
+
+def contiguity(geodata, code = 'PRO_COM_T', kind = 'queen', cachedir = None, tolerance = 0):
+    """Contiguity of the comuni, read from the cache directory when the same
+    geometries were already processed, built (and cached) otherwise.
+    """
+    if cachedir is None:
+        return build_contiguity(geodata, code = code, kind = kind, tolerance = tolerance)
+    fname = osp.join(cachedir, 'contiguity-%s-%s-%s.npz' % (kind, tolerance, geodigest(geodata, code = code)))
+    if osp.exists(fname):
+        return Contiguity.load(fname)
+    os.makedirs(cachedir, exist_ok=True)
+    cont = build_contiguity(geodata, code = code, kind = kind, tolerance = tolerance)
+    cont.save(fname)
+    return cont
+
+
+#%% Smoothing
+
+def pooled_rates(observed, expected, cont, include_self = True):
+    """Ratio of observed over expected deaths pooled over the neighbourhood of
+    every comune, i.e. ``(o_i + sum_j o_j) / (e_i + sum_j e_j)``.
+
+    Arrays may be 2-D (comuni x windows), in which case all columns are
+    smoothed at once.
+    """
+    o, e = np.nan_to_num(_frame(observed, cont)), np.nan_to_num(_frame(expected, cont))
+    w = _weights(cont, include_self)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _wrap((w @ o) / (w @ e), observed, cont)
+
+
+def eb_rates(observed, expected, cont = None, include_self = True):
+    """Empirical Bayes (Marshall) estimates of the ratio of observed over expected deaths.
+
+    Raw ratios are shrunk towards the global mean (`cont` is None) or towards
+    the mean of the neighbourhood of every comune, with a strength that decreases
+    with the expected counts, so that tiny comuni are smoothed most.
+    """
+    o, e = np.nan_to_num(_frame(observed, cont)), np.nan_to_num(_frame(expected, cont))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.where(e > 0, o / e, np.nan)
+        if cont is None:
+            osum, esum = o.sum(axis=0), e.sum(axis=0)
+            m = osum / esum
+            s2 = np.nansum(e * (r - m)**2, axis=0) / esum - m / (esum / np.maximum((e > 0).sum(axis=0), 1))
+        else:
+            w = _weights(cont, include_self)
+            nb = np.asarray(w.sum(axis=1)).reshape((-1,) + (1,) * (o.ndim - 1))
+            esum = w @ e
+            m = (w @ o) / esum
+            # weighted variance of the raw ratios in the neighbourhood, with w @ (e*(r-m)^2)
+            # expanded so that it only involves sparse products
+            r0 = np.nan_to_num(r)
+            s2 = (w @ (e * r0**2) - 2 * m * (w @ (e * r0)) + m**2 * esum) / esum - m / (esum / nb)
+        s2 = np.maximum(s2, 0)
+        c = np.where(e > 0, s2 / (s2 + m / e), 0)
+        return _wrap(np.where(np.isfinite(m), m + c * (np.nan_to_num(r) - m), np.nan), observed, cont)
+
+
+def _weights(cont, include_self):
+    w = cont.matrix.astype(float)
+    return w + sparse.identity(w.shape[0], format='csr') if include_self else w
+
+def _frame(values, cont):
+    # values given as series indexed by comuni are aligned on the contiguity
+    if isinstance(values, (pd.Series, pd.DataFrame)):
+        if cont is not None:
+            values = values.set_axis(pd.Index(values.index).astype(str), axis=0).reindex(cont.codes)
+        return values.to_numpy(dtype=float)
+    return np.asarray(values, dtype=float)
+
+def _wrap(result, like, cont):
+    if isinstance(like, pd.Series):
+        return pd.Series(result, index = cont.codes if cont is not None else like.index, name = like.name)
+    if isinstance(like, pd.DataFrame):
+        return pd.DataFrame(result, index = cont.codes if cont is not None else like.index,
+                            columns = like.columns)
+    return result
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+.. _ITstore
+
+Persistent and versioned store of the tables derived from IT mortality data.
+
+Every derived table (e.g. ``dailydeaths``, ``citydeaths``) is saved on disk
+together with the parameters it was computed with (area, age band, window,
+baseline, ...) and the version of the input data, so that it can be reloaded
+instead of recomputed, and compared across data releases.
+
+**Dependencies**
+
+*require*:      :mod:`numpy`, :mod:`pandas`
+
+**Contents**
+"""
+
+# *since*:        Mon Oct 19 13:40:52 2026
+
+#%% Settings
+
+import os
+from os import path as osp
+import warnings
+import hashlib
+
+from collections import OrderedDict
+from datetime import datetime
+
+try:
+    import numpy as np
+    import pandas as pd
+except:
+    raise IOError("Impossible to handle dataframe not available: abort...")
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+STOREDIR = osp.join(osp.dirname(__file__), '../results')
+MANIFEST = 'manifest.json'
+
+
+#%% Versions and keys
+
+def data_version(data, length = 12):
+    """Digest of the content of the input data, used as data version.
+    """
+    h = pd.util.hash_pandas_object(data, index=False).values
+    return hashlib.sha1(h.tobytes()).hexdigest()[:length]
+
+def _jsonable(obj):
+    if isinstance(obj, (range, tuple, set)):     return list(obj)
+    if isinstance(obj, slice):                  return [obj.start, obj.stop, obj.step]
+    if isinstance(obj, np.integer):             return int(obj)
+    if isinstance(obj, np.floating):            return float(obj)
+    if isinstance(obj, (datetime, pd.Timestamp)):   return obj.isoformat()
+    return str(obj)
+
+def params_key(name, **params):
+    # canonical key of a table: its name and the digest of its parameters
+    spec = json.dumps(params, sort_keys=True, default=_jsonable)
+    return '%s-%s' % (name, hashlib.sha1(spec.encode('utf-8')).hexdigest()[:10]), \
+        json.loads(spec)
+
+
+#%% Store
+
+class ResultStore(object):
+    """Directory of derived tables ``<root>/<name>/<version>/<key>.pkl`` with a manifest.
+    """
+
+    def __init__(self, root = STOREDIR):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+        self._manifest = None
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            try:
+                with open(osp.join(self.root, MANIFEST), 'r') as f:
+                    self._manifest = json.load(f)
+            except (IOError, ValueError):
+                self._manifest = []
+        return self._manifest
+
+    def _dump_manifest(self):
+        fname = osp.join(self.root, MANIFEST)
+        with open(fname + '.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(fname + '.tmp', fname)
+
+    def entries(self, name = None, version = None, **params):
+        key = None if params == {} or name is None else params_key(name, **params)[0]
+        return [e for e in self.manifest
+                if (name is None or e['name'] == name)
+                and (version is None or e['version'] == version)
+                and (key is None or e['key'] == key)]
+
+    def versions(self, name, **params):
+        # data versions available for a table, from the oldest to the latest
+        return list(OrderedDict.fromkeys(e['version'] for e in
+                                         sorted(self.entries(name, **params), key=lambda e: e['created'])))
+
+    def has(self, name, version, **params):
+        return self.entries(name, version = version, **params) != []
+
+    def put(self, name, table, version, **params):
+        key, params = params_key(name, **params)
+        path = osp.join(name, version, '%s.pkl' % key)
+        os.makedirs(osp.join(self.root, name, version), exist_ok=True)
+        pd.to_pickle(table, osp.join(self.root, path) + '.tmp')
+        os.replace(osp.join(self.root, path) + '.tmp', osp.join(self.root, path))
+        self._manifest = [e for e in self.manifest
+                          if not (e['key'] == key and e['version'] == version)]
+        self._manifest.append({'name':      name,
+                               'key':       key,
+                               'version':   version,
+                               'params':    params,
+                               'file':      path,
+                               'shape':     list(getattr(table, 'shape', ())),
+                               'created':   datetime.now().isoformat()})
+        self._dump_manifest()
+        return table
+
+    def get(self, name, version = None, **params):
+        # latest version of the table, unless specified
+        entries = sorted(self.entries(name, version = version, **params), key=lambda e: e['created'])
+        if params == {}:
+            # without parameters, only tables stored without any are matched
+            entries = [e for e in entries if e['params'] == {}]
+        if entries == []:
+            raise IOError("No table '%s' stored for version %s and parameters %s"
+                          % (name, version, params))
+        return pd.read_pickle(osp.join(self.root, entries[-1]['file']))
+
+    def cached(self, name, func, version, **params):
+        # reload the table when available, otherwise compute it with func(**params)
+        # and store it
+        try:
+            return self.get(name, version = version, **params)
+        except IOError:
+            return self.put(name, func(**params), version, **params)
+
+    def diff(self, name, old, new, **params):
+        """Difference (`new` - `old`) between two versions of a table, aligned on
+        index and columns; non numeric columns are dropped.
+        """
+        told, tnew = self.get(name, version = old, **params), self.get(name, version = new, **params)
+        if isinstance(told, pd.Series): told = told.to_frame()
+        if isinstance(tnew, pd.Series): tnew = tnew.to_frame()
+        told, tnew = told.select_dtypes('number'), tnew.select_dtypes('number')
+        return tnew.sub(told, fill_value = 0)
+
+    def remove(self, name, version = None, **params):
+        for e in self.entries(name, version = version, **params):
+            try:                os.remove(osp.join(self.root, e['file']))
+            except OSError:     warnings.warn("File %s not found in the store" % e['file'])
+            self._manifest.remove(e)
+        self._dump_manifest()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+.. _ITtiming
+
+Epidemic timing features of IT mortality data.
+
+For every series of a :class:`ITcube.DeathCube` (comuni, provinces, age
+bands, ...), the daily deaths of the current year are compared with the upper
+bound of the expected band of the baseline, and the following features are
+derived along the day axis for all series at once:
+
+* ``onset``: first day of the first run of `sustain` consecutive days above the band,
+* ``end``: last day above the band,
+* ``duration``: number of days above the band,
+* ``peak`` and ``peakexcess``: day and value of the largest (smoothed) excess,
+* ``excess`` and ``rinc``: total excess over the period and its relative increment.
+
+The result is a single table indexed by area (and age), ready to be merged with
+the geographical data for choropleth maps.
+
+**Dependencies**
+
+*require*:      :mod:`numpy`, :mod:`pandas`
+
+*optional*:     :mod:`scipy`
+
+**Contents**
+"""
+
+# *since*:        Mon Oct 19 12:28:27 2026
+
+#%% Settings
+
+try:
+    import numpy as np
+    import pandas as pd
+except:
+    raise IOError("Impossible to handle dataframe not available: abort...")
+
+from ITcube import YEAR
+from ITbaseline import baseline, dispersion, expected_band, excess
+from ITsignif import rolling_windows
+
+
+#%% Features
+
+def _first(mask):
+    # position of the first True along the last axis, -1 if none
+    pos = np.argmax(mask, axis=-1)
+    return np.where(mask.any(axis=-1), pos, -1)
+
+def _smooth(values, width):
+    # centred moving average along the last axis, with edges padded
+    if width <= 1:
+        return values
+    pad = width // 2
+    sums, _ = rolling_windows(np.pad(values, [(0,0)] * (values.ndim - 1) + [(pad, width-1-pad)],
+                                     mode='edge'), width = width, dtype = np.float64)
+    return sums / width
+
+
+def timing(cube, year = YEAR, method = 'mean', ref = None, start = None, end = None,
+           level = 0.95, family = 'quasipoisson', threshold = None, sustain = 3, smooth = 7, **kwargs):
+    """Compute the timing features of all the series of the cube over the
+    days from `start` to `end`.
+
+    Days are above the band when the deaths exceed the upper bound of the
+    expected band at `level` (see :func:`ITbaseline.expected_band`), or,
+    when `threshold` is set, when they exceed the baseline by more than
+    `threshold` (relative increment). Peaks are searched on the excess
+    smoothed over `smooth` days.
+    """
+    sl = cube.day_slice(start, end)
+    values = np.asarray(cube.values[..., sl], dtype=float)
+    days = cube.days[sl]
+    observed = values[..., cube.year_index(year), :]
+    base = baseline(values, cube.years, method = method, ref = ref, year = year, **kwargs)
+    if threshold is not None:
+        upper = base * (1 + threshold)
+    else:
+        phi = dispersion(values, cube.years, ref = ref, year = year, pooled = True) \
+            if family == 'quasipoisson' else None
+        _, upper = expected_band(base, level = level, family = family, phi = phi)
+    above = observed > upper
+
+    # onset: first window of `sustain` days all above the band
+    runs, starts = rolling_windows(above.astype(np.int32), width = sustain)
+    ionset = _first(runs == sustain)
+    ionset = np.where(ionset >= 0, starts[np.maximum(ionset, 0)], -1)
+    iend = np.where(above.any(axis=-1), above.shape[-1] - 1 - _first(above[..., ::-1]), -1)
+    exc, _ = excess(observed, base)
+    sexc = _smooth(exc, smooth)
+    ipeak = np.argmax(sexc, axis=-1)
+    peakexcess = np.take_along_axis(sexc, ipeak[..., None], axis=-1)[..., 0]
+    total, rinc = excess(observed.sum(axis=-1), base.sum(axis=-1))
+
+    if cube.ages is not None:
+        index = pd.MultiIndex.from_product([cube.codes, cube.ages],
+                                           names = [cube.codes.name or 'area', 'age'])
+    else:
+        index = pd.Index(cube.codes, name = cube.codes.name or 'area')
+    def _days(pos):
+        pos = pos.ravel()
+        return days[np.maximum(pos, 0)].where(pos >= 0)
+    table = pd.DataFrame({'onset':       _days(ionset),
+                          'end':         _days(iend),
+                          'duration':    above.sum(axis=-1).ravel(),
+                          'peak':        _days(np.where(peakexcess > 0, ipeak, -1)),
+                          'peakexcess':  peakexcess.ravel(),
+                          'observed':    observed.sum(axis=-1).ravel(),
+                          'expected':    base.sum(axis=-1).ravel(),
+                          'excess':      total.ravel(),
+                          'rinc':        rinc.ravel()
+                          }, index = index)
+    if cube.missing is not None:
+        # features of series with incomplete counts in `year` are not reliable
+        missing = np.asarray(cube.missing)[:, cube.year_index(year)]
+        if cube.ages is not None:
+            missing = np.repeat(missing, len(cube.ages))
+        if missing.any():
+            table.loc[missing, table.columns] = np.nan
+    return table
+
+
+def timing_levels(cube, levels = (None,), **kwargs):
+    """Run :func:`timing` on the cube and its aggregates, e.g. ``(None, 'PROV', 'REG')``,
+    and stack the results in one table.
+    """
+    tables = []
+    for level in levels:
+        c = cube if level is None else cube.aggregate(level)
+        t = timing(c, **kwargs)
+        t.insert(0, 'level', c.level)
+        t.index = t.index.set_names(['area'] + list(t.index.names[1:]))
+        tables.append(t)
+    return pd.concat(tables)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+.. _ITzones
+
+Aggregation of IT mortality data to custom zones of comuni.
+
+A zone definition (ASL districts, metropolitan cities ``COD_CM``, ad-hoc lists
+of comuni, ...) is compiled into a sparse membership matrix of shape
+``(zone, comune)``. All the series of all the zones are then obtained from a
+single sparse matrix product with the per-comune count cube
+(:class:`ITcube.DeathCube`), instead of one groupby per zone. Zones may
+overlap, and memberships may be weighted.
+
+**Dependencies**
+
+*require*:      :mod:`numpy`, :mod:`pandas`, :mod:`scipy`
+
+**Contents**
+"""
+
+# *since*:        Mon Oct 19 12:23:09 2026
+
+#%% Settings
+
+try:
+    import numpy as np
+    import pandas as pd
+except:
+    raise IOError("Impossible to handle dataframe not available: abort...")
+
+from ITlazy import lazy_import
+from ITcube import DeathCube
+
+sparse = lazy_import('scipy.sparse', msg = "Package scipy not available: zones not supported")
+
+
+#%% Zones
+
+class ZoneMap(object):
+    """Sparse membership matrix of comuni (columns) into zones (rows).
+    """
+
+    def __init__(self, matrix, zones, comuni, name = 'zone'):
+        self.matrix = sparse.csr_matrix(matrix)
+        self.zones = pd.Index(zones, name = name)
+        self.comuni = pd.Index(comuni)
+        if self.matrix.shape != (len(self.zones), len(self.comuni)):
+            raise IOError("Membership matrix of shape %s does not match %s zones x %s comuni"
+                          % (self.matrix.shape, len(self.zones), len(self.comuni)))
+
+    @classmethod
+    def from_pairs(cls, comuni, zones, weights = None, name = 'zone'):
+        # one (comune, zone[, weight]) membership per item
+        comuni, zones = pd.Series(comuni).astype(str).values, pd.Series(zones).values
+        ic, cuniq = pd.factorize(comuni, sort = True)
+        iz, zuniq = pd.factorize(zones, sort = True)
+        w = np.ones(len(ic)) if weights is None else np.asarray(weights, dtype=float)
+        matrix = sparse.coo_matrix((w, (iz, ic)), shape = (len(zuniq), len(cuniq))).tocsr()
+        matrix.sum_duplicates()
+        return cls(matrix, zuniq, cuniq, name = name)
+
+    @classmethod
+    def from_dict(cls, zones, name = 'zone'):
+        # {zone: [comuni]}
+        pairs = [(c, z) for z, comuni in zones.items() for c in comuni]
+        return cls.from_pairs([p[0] for p in pairs], [p[1] for p in pairs], name = name)
+
+    @classmethod
+    def from_frame(cls, frame, zone, code = 'PRO_COM_T', weight = None, drop = None):
+        """Memberships read from the columns of a table, e.g. the attributes of
+        the geographical data (``COD_CM``, ``COD_RIP``, ...).
+
+        Zones listed in `drop` (e.g. ``[0]`` for comuni outside any
+        metropolitan city) are ignored.
+        """
+        frame = frame[[code, zone] + ([] if weight is None else [weight])].dropna(subset = [code, zone])
+        if drop is not None:
+            frame = frame[~frame[zone].isin(list(drop))]
+        return cls.from_pairs(frame[code], frame[zone],
+                              weights = None if weight is None else frame[weight], name = zone)
+
+    @classmethod
+    def from_csv(cls, source, zone, code = 'PRO_COM_T', weight = None, drop = None, **kwargs):
+        frame = pd.read_csv(source, dtype = {code: str}, **kwargs)
+        return cls.from_frame(frame, zone, code = code, weight = weight, drop = drop)
+
+    @property
+    def sizes(self):
+        return pd.Series(np.diff(self.matrix.indptr), index = self.zones, name = 'ncomuni')
+
+    def align(self, codes):
+        """Membership matrix with its columns reordered along the given comuni codes;
+        comuni of the zones that are missing from `codes` are dropped.
+        """
+        icol = pd.Index(codes).astype(str).get_indexer(self.comuni)
+        keep = icol >= 0
+        matrix = self.matrix.tocsc()[:, np.flatnonzero(keep)].tocoo()
+        return sparse.csr_matrix((matrix.data, (matrix.row, icol[keep][matrix.col])),
+                                 shape = (len(self.zones), len(codes)))
+
+    def aggregate(self, cube):
+        """Series of all the zones, computed with one sparse product over the
+        comuni of the cube; returns a :class:`ITcube.DeathCube` with zones as areas.
+        """
+        matrix = self.align(cube.codes)
+        shp = cube.values.shape
+        values = matrix @ cube.values.reshape(shp[0], -1)
+        if np.issubdtype(cube.values.dtype, np.integer) and np.all(self.matrix.data == 1):
+            values = values.astype(cube.values.dtype)
+        values = values.reshape((len(self.zones),) + shp[1:])
+        missing = None if cube.missing is None else \
+            (matrix.astype(bool).astype(np.int32) @ cube.missing.astype(np.int32)) > 0
+        areas = pd.DataFrame({'ncomuni': np.diff(matrix.indptr)}, index = self.zones)
+        return DeathCube(values, areas, cube.years, cube.days, ages = cube.ages, sex = cube.sex,
+                         missing = missing, level = self.zones.name)
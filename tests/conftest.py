@@ -0,0 +1,32 @@
+import sys
+from os import path as osp
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, osp.join(osp.dirname(__file__), '..', 'src'))
+
+
+def synthetic_data(ncomuni=6, ndays=40, seed=0):
+    # synthetic table in the layout of the ISTAT daily deaths
+    rng = np.random.default_rng(seed)
+    rows = []
+    for k in range(ncomuni):
+        prov, reg = 1 + k // 3, 1 + k // 6
+        for d in pd.date_range('2000-01-01', periods=ndays):
+            for age in rng.choice(22, size=3, replace=False):
+                row = {'REG': reg, 'PROV': prov, 'NOME_REGIONE': 'R%d' % reg,
+                       'NOME_PROVINCIA': 'P%d' % prov, 'NOME_COMUNE': 'C%d' % k,
+                       'COD_PROVCOM': '%03d%03d' % (prov, k), 'TIPO_COMUNE': 1,
+                       'CL_ETA': int(age), 'GE': d.strftime('%m%d')}
+                for y in range(15, 21):
+                    m, f = rng.poisson(1, size=2)
+                    row.update({'M_%d' % y: m, 'F_%d' % y: f, 'T_%d' % y: m + f})
+                rows.append(row)
+    return pd.DataFrame(rows)
+
+
+@pytest.fixture(scope='session')
+def data():
+    return synthetic_data()
@@ -0,0 +1,36 @@
+import io
+import sys
+from os import path as osp
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, osp.join(osp.dirname(__file__), '..', 'src'))
+
+gpd = pytest.importorskip('geopandas')
+pytest.importorskip('matplotlib')
+Image = pytest.importorskip('PIL.Image')
+from shapely.geometry import box
+
+from ITmapcache import ChoroplethTiles, TileCache
+
+
+def _grid(nx=8, ny=4):
+    # rectangular "comuni" over a domain twice as wide as high
+    cells = [box(i, j, i + 1, j + 1) for i in range(nx) for j in range(ny)]
+    codes = ['%06d' % k for k in range(len(cells))]
+    return gpd.GeoDataFrame({'PRO_COM_T': codes}, geometry=cells), pd.Series(
+        np.arange(len(cells), dtype=float), index=codes)
+
+
+def test_tile_fills_its_bounds():
+    geodata, values = _grid()
+    tiles = ChoroplethTiles(geodata, cache=TileCache(), tilesize=64)
+    for zoom, x, y in ((0, 0, 0), (1, 0, 1), (2, 1, 2)):
+        png = tiles.tile(values, zoom=zoom, x=x, y=y, style={'edgecolor': 'none'})
+        alpha = np.asarray(Image.open(io.BytesIO(png)).convert('RGBA'))[..., 3]
+        assert alpha.shape == (64, 64)
+        # fully inside the polygons: no transparent pixel column (nor row)
+        assert not (alpha == 0).all(axis=0).any()
+        assert not (alpha == 0).all(axis=1).any()
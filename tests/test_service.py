@@ -0,0 +1,109 @@
+import asyncio
+import json
+import sys
+import threading
+import urllib.error
+import urllib.request
+from os import path as osp
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, osp.join(osp.dirname(__file__), '..', 'src'))
+
+from ITcube import load_meta
+from ITservice import MortalityAggregates, QueryService
+
+pa = pytest.importorskip('pyarrow')
+
+
+@pytest.fixture(scope='module')
+def server(data):
+    service = QueryService(MortalityAggregates(data, load_meta()), max_workers=2)
+    loop = asyncio.new_event_loop()
+    srv = loop.run_until_complete(service.start('127.0.0.1', 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d' % srv.sockets[0].getsockname()[1]
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    srv.close()
+    service.executor.shutdown()
+
+
+def _get(url):
+    try:
+        with urllib.request.urlopen(url) as r:
+            return r.status, r.headers['Content-Type'], r.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers['Content-Type'], e.read()
+
+
+def _json(body):
+    split = json.loads(body.decode('utf-8'))
+    return pd.DataFrame(split['data'], index=split['index'], columns=split['columns'])
+
+
+def _arrow(body):
+    return pa.ipc.open_stream(body).read_all().to_pandas()
+
+
+@pytest.mark.parametrize('target, shape', [
+    ('/series?area=001000&level=comune', (40, 6)),
+    ('/series?area=001&level=prov&kind=cumulative&start=0110&end=0119', (10, 6)),
+    ('/series?level=it&kind=weekly&sex=f', None),
+    ('/ages?area=001000&level=comune&start=0101&end=0131', (22, 6)),
+    ('/ages?area=1&level=reg', (22, 6)),
+    ('/excess?level=prov&top=1', (1, None)),
+    ('/areas?level=prov', (2, None)),
+])
+def test_json_and_arrow(server, target, shape):
+    status, ctype, body = _get(server + target)
+    assert status == 200 and ctype == 'application/json'
+    frame = _json(body)
+    status, ctype, body = _get(server + target + '&format=arrow')
+    assert status == 200 and ctype == 'application/vnd.apache.arrow.stream'
+    table = _arrow(body)
+    assert len(table) == len(frame)
+    if shape is not None:
+        assert frame.shape[0] == shape[0]
+        if shape[1] is not None:
+            assert frame.shape[1] == shape[1]
+
+
+def test_series_values(server, data):
+    status, _, body = _get(server + '/series?area=001000&level=comune&start=0101&end=0105')
+    frame = _json(body)
+    expected = data[data['COD_PROVCOM'] == '001000'].groupby('GE')['T_20'].sum()
+    assert np.array_equal(frame[2020].values, expected.values[:5])
+
+
+def test_excess_sorted(server):
+    status, _, body = _get(server + '/excess?level=comune&sort=excess')
+    frame = _json(body)
+    assert status == 200 and len(frame) == 6
+    assert (np.diff(frame['excess'].values) <= 0).all()
+
+
+@pytest.mark.parametrize('target, status', [
+    ('/series?area=001000&level=district', 400),
+    ('/series?area=001000&sex=x', 400),
+    ('/series?area=001000&kind=monthly', 400),
+    ('/excess?sort=observed', 400),
+    ('/series?area=001000&format=xml', 400),
+    ('/series?area=001000&unknown=1', 400),
+    ('/series?area=999999', 404),
+    ('/ages?area=999999', 404),
+    ('/nowhere', 404),
+])
+def test_errors(server, target, status):
+    code, ctype, body = _get(server + target)
+    assert code == status and ctype == 'application/json'
+    assert b'error' in body
+
+
+def test_arrow_not_available(server, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    code, _, body = _get(server + '/areas?level=reg&format=arrow')
+    assert code == 406 and b'Arrow' in body
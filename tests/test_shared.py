@@ -0,0 +1,38 @@
+import sys
+from os import path as osp
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, osp.join(osp.dirname(__file__), '..', 'src'))
+
+from ITcube import load_meta, build_cube
+from ITshared import publish_data, attach
+
+
+@pytest.mark.parametrize('arrow', [False, True])
+def test_publish_data(tmp_path, data, arrow):
+    if arrow:
+        pytest.importorskip('pyarrow')
+    meta = load_meta()
+    root = str(tmp_path)
+    publish_data(data, root, 'v1', meta = meta, sexes = ('t',), arrow = arrow)
+    shared = attach(root)
+    assert shared.version == 'v1' and sorted(shared.names) == ['cube_t', 'data']
+    assert shared.manifest['items']['data']['format'] == ('arrow' if arrow else 'npy')
+    cube, expected = shared.cube('cube_t'), build_cube(data, meta)
+    assert np.array_equal(cube.values, expected.values)
+    frame = shared.frame('data')
+    assert np.array_equal(frame['T_20'].to_numpy(), data['T_20'].to_numpy())
+    if not arrow:
+        with pytest.raises(IOError, match = 'Arrow'):
+            shared.arrow('data')
+
+
+def test_publish_data_once(tmp_path, data):
+    root = str(tmp_path)
+    target = publish_data(data, root, 'v1', sexes = ('t',), table = False, arrow = False)
+    mtime = osp.getmtime(osp.join(target, 'manifest.json'))
+    # already published: nothing rewritten, whatever the data
+    assert publish_data(data.iloc[:0], root, 'v1', sexes = ('t',)) == target
+    assert osp.getmtime(osp.join(target, 'manifest.json')) == mtime
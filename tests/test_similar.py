@@ -0,0 +1,60 @@
+import sys
+from os import path as osp
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, osp.join(osp.dirname(__file__), '..', 'src'))
+
+from ITsimilar import CurveIndex
+
+
+def _curves(n=300, length=50, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(rng.normal(size=(n, length)), index=['%06d' % i for i in range(n)])
+
+
+def _brute(curves, code, k):
+    d = ((curves - curves.loc[code]) ** 2).sum(axis=1).drop(code)
+    return list(d.sort_values(kind='stable').index[:k])
+
+
+def test_knn_exact():
+    curves = _curves()
+    index = CurveIndex(curves)
+    table = index.knn(list(curves.index[:20]), k=5)
+    assert len(table) == 100 and list(table['rank'][:5]) == [1, 2, 3, 4, 5]
+    for code, t in table.groupby('query'):
+        assert list(t['area']) == _brute(curves, code, 5)
+        assert (np.diff(t['distance'].values) >= 0).all()
+
+
+def test_knn_approx_all_cells():
+    # probing all the cells, the approximate search is exact
+    curves = _curves()
+    exact = CurveIndex(curves).knn(list(curves.index[:50]), k=7)
+    approx = CurveIndex(curves, mode='approx', ncells=10, nprobe=10).knn(list(curves.index[:50]), k=7)
+    assert list(approx['area']) == list(exact['area'])
+    assert np.allclose(approx['distance'], exact['distance'], atol=1e-4)
+
+
+def test_knn_curves_and_large_k():
+    curves = _curves(n=20)
+    for mode in ('exact', 'approx'):
+        index = CurveIndex(curves, mode=mode, ncells=4, nprobe=4)
+        # a query given as a curve is not excluded from its own results
+        table = index.knn(curves.iloc[:2], k=3)
+        assert list(table['area'][table['rank'] == 1]) == list(curves.index[:2])
+        assert len(index.knn(curves.index[0], k=50)) == 19
+
+
+def test_range():
+    curves = _curves()
+    for mode in ('exact', 'approx'):
+        index = CurveIndex(curves, mode=mode, ncells=10, nprobe=10)
+        knn = index.knn(list(curves.index[:10]), k=3)
+        radius = knn.groupby('query')['distance'].max().median()
+        table = index.range(list(curves.index[:10]), radius)
+        assert (table['distance'] <= radius + 1e-4).all()
+        for code, t in table.groupby('query'):
+            assert list(t['area']) == _brute(curves, code, len(t))
@@ -0,0 +1,87 @@
+import sys
+from os import path as osp
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, osp.join(osp.dirname(__file__), '..', 'src'))
+
+from ITcube import DeathCube, day_timeline
+from ITtiming import _smooth, timing
+
+YEARS = [2015, 2016, 2017, 2018, 2019, 2020]
+
+
+def _convolve(values, width):
+    pad = width // 2
+    padded = np.pad(values, (pad, width - 1 - pad), mode='edge')
+    return np.convolve(padded, np.ones(width) / width, mode='valid')
+
+
+def test_smooth_matches_convolve():
+    rng = np.random.default_rng(0)
+    values = rng.normal(0.3, 2., size=(5, 60))
+    for width in (3, 7, 8):
+        expected = np.vstack([_convolve(v, width) for v in values])
+        assert np.allclose(_smooth(values, width), expected)
+
+
+def test_smooth_keeps_fractions():
+    assert np.allclose(_smooth(np.full((2, 20), 0.6), 7), 0.6)
+
+
+def _cube(missing = None):
+    # 10 deaths a day in every year; in 2020 the first area has a 5-day wave
+    # of 30 deaths from day 10 and an isolated day of 20 deaths on day 20,
+    # the second area stays at the baseline
+    values = np.full((2, len(YEARS), 30), 10, dtype=np.int32)
+    values[0, -1, 10:15] = 30
+    values[0, -1, 20] = 20
+    areas = pd.DataFrame({'name': ['A', 'B']}, index=pd.Index(['001', '002'], name='code'))
+    return DeathCube(values, areas, YEARS, day_timeline(0, 29), missing=missing)
+
+
+def test_timing_features():
+    days = day_timeline(0, 29)
+    table = timing(_cube(), smooth=1)
+    a = table.loc['001']
+    assert a['onset'] == days[10] and a['end'] == days[20]
+    assert a['duration'] == 6
+    assert a['peak'] == days[10] and a['peakexcess'] == 20
+    assert a['observed'] == 410 and a['expected'] == 300
+    assert a['excess'] == 110 and np.isclose(a['rinc'], 110 / 300)
+
+
+def test_timing_smoothed_peak():
+    # centred on the wave: the only 5-day window covering all of it
+    table = timing(_cube(), smooth=5)
+    assert table.loc['001', 'peak'] == day_timeline(0, 29)[12]
+    assert np.isclose(table.loc['001', 'peakexcess'], 20)
+
+
+def test_timing_sustain():
+    # the isolated day above the band is not an onset on its own
+    values = _cube().values.copy()
+    values[0, -1, 10:15] = 10
+    cube = DeathCube(values, _cube().areas, YEARS, day_timeline(0, 29))
+    a = timing(cube).loc['001']
+    assert pd.isna(a['onset']) and a['end'] == day_timeline(0, 29)[20]
+    assert a['duration'] == 1
+
+
+def test_timing_nothing_above():
+    b = timing(_cube()).loc['002']
+    assert pd.isna(b['onset']) and pd.isna(b['end']) and pd.isna(b['peak'])
+    assert b['duration'] == 0 and b['excess'] == 0 and b['rinc'] == 0
+
+
+def test_timing_missing():
+    missing = np.zeros((2, len(YEARS)), dtype=bool)
+    missing[1, -1] = True
+    table = timing(_cube(missing=missing))
+    assert table.loc['002'].isna().all()
+    assert table.loc['001', 'duration'] == 6
+    # incomplete reference years do not blank the current year
+    missing[:] = False
+    missing[1, 0] = True
+    assert timing(_cube(missing=missing)).loc['002', ['duration', 'observed', 'excess']].notna().all()